@@ -0,0 +1,48 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_VIEW_THREADS,
+    thread_name_prefix='async-view',
+)
+
+
+def run_view(view, request, *args, **kwargs):
+    """Выполняет синхронное представление и рендерит ответ в потоке пула."""
+
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """Асинхронная обертка над синхронным представлением для ASGI.
+
+    Представление выполняется в ограниченном пуле потоков, а не
+    в общем потоке sync_to_async(thread_sensitive=True), поэтому
+    запросы на чтение обрабатываются параллельно, а число соединений
+    с базой не превышает размер пула.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            executor,
+            functools.partial(
+                context.run, run_view, view, request, *args, **kwargs
+            )
+        )
+
+    return wrapper
@@ -0,0 +1,250 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .replicas import use_primary
+
+User = get_user_model()
+
+AUTH_TOKEN_KEY = 'auth_snapshot:{digest}'
+AUTH_GENERATION_KEY = 'auth_generation:{user_id}'
+SIGNED_TOKEN_SALT = 'api.authentication.signed_token'
+
+# Поля пользователя, которых хватает представлениям и /users/me/.
+# Остальные поля отложены и загружаются из базы при обращении.
+# Счетчики и token_generation не кэшируются: save() снимка записал бы
+# устаревшие значения. Поколение хранится рядом со снимком.
+SNAPSHOT_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name',
+                   'avatar', 'avatar_thumbnails', 'is_active', 'is_staff',
+                   'is_superuser')
+SIGNED_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser')
+
+
+def token_cache_key(key):
+    """Ключ кэша по хэшу токена, чтобы сам токен не попадал в кэш."""
+
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return AUTH_TOKEN_KEY.format(digest=digest)
+
+
+def make_snapshot(user, fields=SNAPSHOT_FIELDS):
+    values = []
+    for name in fields:
+        value = getattr(user, name)
+        if name == 'avatar':
+            value = value.name or None
+        values.append(value)
+    return values
+
+
+def user_from_snapshot(values, fields=SNAPSHOT_FIELDS):
+    """Пользователь из снимка без запроса к базе.
+
+    Не вошедшие в снимок поля отложены, поэтому save() обновляет
+    только загруженные поля и не затирает остальные.
+    """
+
+    data = dict(zip(fields, values))
+    # from_db ожидает значения в порядке полей модели.
+    names = [
+        field.attname for field in User._meta.concrete_fields
+        if field.attname in data
+    ]
+    return User.from_db(
+        DEFAULT_DB_ALIAS, names, [data[name] for name in names]
+    )
+
+
+class LocalTokenCache:
+    """LRU снимков пользователей в памяти процесса с коротким TTL."""
+
+    def __init__(self, maxsize):
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, snapshot = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return snapshot
+
+    def set(self, key, snapshot):
+        with self._lock:
+            self._items[key] = (
+                time.monotonic() + settings.AUTH_TOKEN_LOCAL_TIMEOUT,
+                snapshot
+            )
+            self._items.move_to_end(key)
+            while len(self._items) > self._maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+
+local_tokens = LocalTokenCache(settings.AUTH_TOKEN_LOCAL_CACHE_SIZE)
+
+
+def signed_tokens_enabled():
+    """Выдаются и принимаются ли подписанные токены.
+
+    Подписанный токен проверяется по поколению в кэше. У локального
+    кэша каждый процесс свой и не видит отзыв в других процессах,
+    поэтому без общего кэша подписанные токены отключены.
+    """
+
+    return settings.AUTH_SIGNED_TOKENS and settings.SHARED_CACHE
+
+
+def get_auth_generation(user_id):
+    """Текущее поколение токенов пользователя, None — если его нет.
+
+    Поколение хранится в User.token_generation, а кэш только ускоряет
+    чтение: вытесненное значение читается из основной базы заново.
+    """
+
+    key = AUTH_GENERATION_KEY.format(user_id=user_id)
+    generation = cache.get(key)
+    if generation is None:
+        with use_primary():
+            generation = User.objects.filter(pk=user_id).values_list(
+                'token_generation', flat=True
+            ).first()
+        if generation is None:
+            return None
+        cache.set(key, generation, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+    return generation
+
+
+def invalidate_token(key):
+    """Сбрасывает кэш токена, например при выходе из системы."""
+
+    cache_key = token_cache_key(key)
+    cache.delete(cache_key)
+    local_tokens.discard(cache_key)
+
+
+def revoke_user_tokens(user_id):
+    """Отзывает подписанные токены и снимки пользователя в кэше.
+
+    Поколение увеличивается в базе, а его копия в кэше удаляется после
+    фиксации транзакции, чтобы следующий запрос прочитал новое значение.
+    """
+
+    User.objects.filter(pk=user_id).update(
+        token_generation=F('token_generation') + 1
+    )
+    transaction.on_commit(
+        lambda: cache.delete(AUTH_GENERATION_KEY.format(user_id=user_id))
+    )
+
+
+def make_signed_token(user):
+    """Подписанный токен, который проверяется без запроса к базе."""
+
+    return signing.dumps(
+        {
+            'u': make_snapshot(user, SIGNED_FIELDS),
+            'g': get_auth_generation(user.pk),
+        },
+        salt=SIGNED_TOKEN_SALT,
+        compress=True
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Аутентификация по токену с кэшированием пользователя.
+
+    Снимок пользователя с поколением токенов хранится в общем кэше
+    (AUTH_TOKEN_CACHE_TIMEOUT) и в памяти процесса
+    (AUTH_TOKEN_LOCAL_TIMEOUT). Снимок из общего кэша сверяется
+    с текущим поколением: снятый до смены пароля, прав или деактивации
+    заменяется данными из базы. Снимок в памяти процесса уже сверен
+    и принимается без обращений к кэшу, поэтому другие процессы
+    замечают отзыв не позже чем через AUTH_TOKEN_LOCAL_TIMEOUT.
+    Без общего кэша снимки не кэшируются и токен читается из базы.
+
+    При AUTH_SIGNED_TOKENS и общем кэше вход выдает подписанные токены,
+    которые проверяются по подписи и поколению без обращения к базе.
+    """
+
+    def lookup_token(self, key):
+        """Токен и пользователь из основной базы.
+
+        Ключ закрепления за основной базой меняется после входа,
+        и отставшая реплика еще не знала бы новый токен.
+        """
+
+        with use_primary():
+            return super().authenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        if signed_tokens_enabled() and ':' in key:
+            return self.authenticate_signed(key)
+        if not settings.SHARED_CACHE:
+            return self.lookup_token(key)
+
+        cache_key = token_cache_key(key)
+        cached = local_tokens.get(cache_key)
+        if cached is not None:
+            # Поколение сверено, когда снимок попал в память процесса.
+            return self.snapshot_credentials(key, cached[1])
+        cached = cache.get(cache_key)
+        if cached is not None:
+            generation, snapshot = cached
+            user = user_from_snapshot(snapshot)
+            # Снимок, снятый до смены пароля или прав, читается заново.
+            if generation == get_auth_generation(user.pk):
+                local_tokens.set(cache_key, cached)
+                return self.snapshot_credentials(key, snapshot)
+        user, token = self.lookup_token(key)
+        cached = (user.token_generation, make_snapshot(user))
+        cache.set(cache_key, cached, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+        local_tokens.set(cache_key, cached)
+        return user, token
+
+    def snapshot_credentials(self, key, snapshot):
+        user = user_from_snapshot(snapshot)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return user, Token(key=key, user=user)
+
+    def authenticate_signed(self, key):
+        try:
+            payload = signing.loads(
+                key,
+                salt=SIGNED_TOKEN_SALT,
+                max_age=settings.AUTH_SIGNED_TOKEN_MAX_AGE
+            )
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        user = user_from_snapshot(payload['u'], SIGNED_FIELDS)
+        if payload['g'] != get_auth_generation(user.pk):
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return user, None
@@ -0,0 +1,94 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Ingredient
+from .replicas import use_primary
+
+INGREDIENT_INDEX_VERSION_KEY = 'ingredient_index:version'
+
+
+class IngredientIndex:
+    """Префиксный индекс ингредиентов в памяти процесса.
+
+    Названия хранятся в отсортированном списке в нижнем регистре,
+    поиск по префиксу выполняется бинарным поиском без запросов к базе
+    и кэшу. Раз в INGREDIENT_INDEX_TTL секунд процесс сверяет версию
+    в общем кэше, которую сигналы и data_loader увеличивают при
+    изменении ингредиентов, и перестраивает индекс, если она сменилась.
+    Без общего кэша (SHARED_CACHE) версия другим процессам не видна,
+    и индекс перестраивается по истечении TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._expires = 0
+        self._keys = []
+        self._rows = []
+
+    def invalidate(self):
+        """Помечает индекс устаревшим в этом и в остальных процессах."""
+
+        self._expires = 0
+        try:
+            cache.incr(INGREDIENT_INDEX_VERSION_KEY)
+        except ValueError:
+            cache.set(INGREDIENT_INDEX_VERSION_KEY, 1, None)
+
+    def _current_version(self):
+        if not settings.SHARED_CACHE:
+            return None
+        return cache.get_or_set(INGREDIENT_INDEX_VERSION_KEY, 0, None)
+
+    def _build(self):
+        rows = sorted(
+            (name.casefold(), id, name, measurement_unit)
+            for id, name, measurement_unit
+            in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).order_by().iterator()
+        )
+        return [row[0] for row in rows], rows
+
+    def _ensure_fresh(self):
+        if time.monotonic() < self._expires:
+            return
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return
+            version = self._current_version()
+            if version is None or version != self._version:
+                with use_primary():
+                    self._keys, self._rows = self._build()
+                self._version = version
+            self._expires = time.monotonic() + settings.INGREDIENT_INDEX_TTL
+
+    def search(self, prefix, limit):
+        """Ингредиенты, название которых начинается с prefix.
+
+        Первым идет точное совпадение, затем более короткие названия;
+        так же сортирует IngredientFilter при поиске в базе.
+        """
+
+        self._ensure_fresh()
+        keys, rows = self._keys, self._rows
+        prefix = prefix.casefold()
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\U0010ffff', lo=start)
+        matches = heapq.nsmallest(
+            limit,
+            rows[start:end],
+            key=lambda row: (row[0] != prefix, len(row[0]), row[0])
+        )
+        return [
+            {'id': id, 'name': name, 'measurement_unit': measurement_unit}
+            for _, id, name, measurement_unit in matches
+        ]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.test import Client
+
+
+def percentile(values: list, percent: float):
+    """Перцентиль по отсортированному списку значений."""
+
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+class NoRedirectHandler(HTTPRedirectHandler):
+    """Не следует редиректам: замеряется ответ самого сервера,
+    например /s/<code>/."""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpTransport:
+    """Запросы к запущенному серверу по HTTP."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = build_opener(NoRedirectHandler)
+
+    def get(self, path, token=None):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        request = Request(self.base_url + path, headers=headers)
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                return response.status < 400
+        except HTTPError as error:
+            return error.code < 400
+        except (URLError, OSError):
+            return False
+
+
+class LocalTransport:
+    """Запросы к приложению в текущем процессе без HTTP-сервера."""
+
+    def __init__(self):
+        host = settings.ALLOWED_HOSTS[0].lstrip('.').replace('*', '')
+        self.host = host or 'localhost'
+
+    def get(self, path, token=None):
+        extra = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        response = Client(HTTP_HOST=self.host).get(path, **extra)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code < 400
+
+
+def run_load(fetch, total: int, concurrency: int):
+    """Выполняет fetch(номер) total раз в concurrency потоков.
+
+    fetch возвращает признак успешного ответа. Результат - общее
+    время, отсортированные задержки успешных запросов и число ошибок.
+    """
+
+    def timed(number):
+        started = time.perf_counter()
+        ok = fetch(number)
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(total)))
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for latency, ok in results if ok)
+    return elapsed, latencies, total - len(latencies)
+
+
+def format_report(total: int, elapsed: float, latencies: list,
+                  errors: int):
+    return (
+        f'запросов: {total}, ошибок: {errors}, '
+        f'{len(latencies) / elapsed:.1f} запросов/с, '
+        f'p50: {percentile(latencies, 50) * 1000:.1f} мс, '
+        f'p95: {percentile(latencies, 95) * 1000:.1f} мс, '
+        f'p99: {percentile(latencies, 99) * 1000:.1f} мс'
+    )
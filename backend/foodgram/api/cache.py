@@ -0,0 +1,236 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, quote_etag, urlencode
+from rest_framework.response import Response
+
+from recipes.models import IngredientInRecipe, ShoppingCart, Tag
+from .replicas import use_primary
+
+SHOPPING_CART_KEY = 'shopping_cart:{user_id}'
+RESPONSE_GENERATION_KEY = 'response_generation:{namespace}'
+RESPONSE_KEY = 'response:{namespace}:{generation}:{digest}'
+
+
+def shopping_cart_key(user_id):
+    """Ключ кэша агрегированного списка покупок пользователя."""
+
+    return SHOPPING_CART_KEY.format(user_id=user_id)
+
+
+def get_shopping_cart(user):
+    """Возвращает пару (хэш, ингредиенты) списка покупок пользователя.
+
+    Сумма ингредиентов считается в базе один раз и хранится в кэше
+    до изменения корзины, ингредиентов рецептов в ней или самих
+    ингредиентов: кэш сбрасывают сигналы из api/signals.py.
+    """
+
+    key = shopping_cart_key(user.id)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    with use_primary():
+        ingredients = list(
+            IngredientInRecipe.objects.filter(
+                recipe__shoppingcart__user=user
+            ).values(
+                'ingredient__name',
+                'ingredient__measurement_unit'
+            ).annotate(sum=Sum('amount')).order_by(
+                'ingredient__name',
+                'ingredient__measurement_unit'
+            ).iterator()
+        )
+    digest = hashlib.md5(
+        json.dumps(ingredients, ensure_ascii=False).encode()
+    ).hexdigest()
+    cache.set(key, (digest, ingredients),
+              settings.SHOPPING_CART_CACHE_TIMEOUT)
+    return digest, ingredients
+
+
+def invalidate_shopping_cart(*user_ids):
+    """Сбрасывает кэш списка покупок указанных пользователей."""
+
+    cache.delete_many([shopping_cart_key(user_id) for user_id in user_ids])
+
+
+def invalidate_recipe_carts(recipe_id):
+    """Сбрасывает кэш у всех пользователей с рецептом в корзине."""
+
+    invalidate_shopping_cart(*ShoppingCart.objects.filter(
+        recipe=recipe_id
+    ).values_list('user_id', flat=True))
+
+
+def invalidate_ingredient_carts(ingredient_id):
+    """Сбрасывает кэш у пользователей, в корзине которых есть рецепт
+    с ингредиентом."""
+
+    invalidate_shopping_cart(*ShoppingCart.objects.filter(
+        recipe__ingredient_list__ingredient=ingredient_id
+    ).values_list('user_id', flat=True).distinct())
+
+
+def get_response_generation(namespace):
+    """Текущее поколение кэша ответов для пространства имен."""
+
+    return cache.get_or_set(
+        RESPONSE_GENERATION_KEY.format(namespace=namespace), 0, None
+    )
+
+
+def bump_response_generation(*namespaces):
+    """Делает устаревшими все закэшированные ответы пространств имен.
+
+    Старые ключи не удаляются, а перестают запрашиваться и вытесняются
+    по времени жизни. Поколение меняется после фиксации транзакции:
+    иначе параллельный запрос успел бы сохранить под новым поколением
+    данные, прочитанные до фиксации.
+    """
+
+    transaction.on_commit(lambda: increment_generations(namespaces))
+
+
+def increment_generations(namespaces):
+    for namespace in namespaces:
+        key = RESPONSE_GENERATION_KEY.format(namespace=namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def response_cache_key(namespace, request):
+    """Ключ ответа: поколение, хост, путь, параметры и способ входа."""
+
+    authenticator = request.successful_authenticator
+    query = urlencode(sorted(request.query_params.lists()), doseq=True)
+    digest = hashlib.md5('|'.join((
+        type(authenticator).__name__ if authenticator else 'anonymous',
+        request.get_host(),
+        request.path,
+        query,
+    )).encode()).hexdigest()
+    return RESPONSE_KEY.format(
+        namespace=namespace,
+        generation=get_response_generation(namespace),
+        digest=digest
+    )
+
+
+class TagSlugMap:
+    """Соответствие слагов тегов их id в памяти процесса.
+
+    Теги меняются редко, поэтому фильтр по тегам не обращается к базе
+    за id. Раз в TAG_SLUGS_TTL секунд процесс сверяет поколение кэша
+    'tags', которое сигналы увеличивают при изменении тегов, и
+    перестраивает соответствие, если оно сменилось. Без общего кэша
+    (SHARED_CACHE) поколение другим процессам не видно, и соответствие
+    перестраивается по истечении TTL; при TAG_SLUGS_TTL=0 слаги
+    читаются из базы на каждый запрос.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._expires = 0
+        self._ids = {}
+
+    def invalidate(self):
+        """Помечает соответствие устаревшим в этом процессе."""
+
+        self._expires = 0
+
+    def _current_generation(self):
+        if not settings.SHARED_CACHE:
+            return None
+        return get_response_generation('tags')
+
+    def _get_ids(self):
+        if time.monotonic() < self._expires:
+            return self._ids
+        with self._lock:
+            if time.monotonic() < self._expires:
+                return self._ids
+            generation = self._current_generation()
+            if generation is None or generation != self._generation:
+                with use_primary():
+                    self._ids = dict(Tag.objects.values_list('slug', 'pk'))
+                self._generation = generation
+            self._expires = time.monotonic() + settings.TAG_SLUGS_TTL
+        return self._ids
+
+    def choices(self):
+        """Варианты для поля фильтра: (слаг, слаг)."""
+
+        return [(slug, slug) for slug in self._get_ids()]
+
+    def get_ids(self, slugs):
+        """id тегов по слагам; при TAG_SLUGS_TTL=0 — подзапрос к тегам."""
+
+        if not settings.TAG_SLUGS_TTL:
+            return Tag.objects.filter(slug__in=slugs).values('pk')
+        ids = self._get_ids()
+        return [ids[slug] for slug in slugs if slug in ids]
+
+
+tag_slugs = TagSlugMap()
+
+
+class AnonymousResponseCacheMixin:
+    """Кэширование ответов list/retrieve для анонимных пользователей.
+
+    Данные ответа хранятся в кэше под ключом с номером поколения,
+    который увеличивается сигналами при изменении моделей. Ответ
+    дополняется заголовками ETag и Cache-Control для прокси. Промах
+    кэша читается из основной базы, а не из реплики. Без общего кэша
+    (SHARED_CACHE) ответы не кэшируются: поколения, увеличенные
+    process_images и data_loader, не дошли бы до веб-процессов.
+    """
+
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not settings.SHARED_CACHE or not request.user.is_anonymous:
+            response = handler(request, *args, **kwargs)
+            patch_vary_headers(response, ('Authorization',))
+            return response
+        key = response_cache_key(self.cache_namespace, request)
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            data = cache.get(key)
+            if data is None:
+                with use_primary():
+                    response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(key, response.data,
+                          settings.RESPONSE_CACHE_TIMEOUT)
+            else:
+                response = Response(data)
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.RESPONSE_CACHE_MAX_AGE
+        )
+        patch_vary_headers(response, ('Authorization',))
+        return response
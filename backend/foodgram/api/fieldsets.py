@@ -0,0 +1,65 @@
+from itertools import chain
+
+from rest_framework.exceptions import ValidationError
+
+FIELDS_PARAM = 'fields'
+OMIT_PARAM = 'omit'
+
+
+def parse_names(value):
+    return {name.strip() for name in (value or '').split(',')} - {''}
+
+
+def get_response_fields(request, available):
+    """Поля ответа из ?fields= без полей из ?omit= в порядке available.
+
+    Без параметров возвращаются все поля. Неизвестное имя — ошибка 400,
+    чтобы опечатка не превращалась в полный или пустой ответ.
+    """
+
+    fields = parse_names(request.query_params.get(FIELDS_PARAM))
+    omit = parse_names(request.query_params.get(OMIT_PARAM))
+    errors = {
+        param: f'Неизвестные поля: {", ".join(sorted(unknown))}.'
+        for param, unknown in (
+            (FIELDS_PARAM, fields.difference(available)),
+            (OMIT_PARAM, omit.difference(available)),
+        )
+        if unknown
+    }
+    if errors:
+        raise ValidationError(errors)
+    return tuple(
+        name for name in available
+        if (not fields or name in fields) and name not in omit
+    )
+
+
+def get_columns(fields, columns, base=('id',)):
+    """Столбцы модели для only()/values(), нужные выбранным полям.
+
+    columns сопоставляет поле ответа столбцам, которые оно читает.
+    """
+
+    return tuple(dict.fromkeys(chain(
+        base, *(columns.get(name, ()) for name in fields)
+    )))
+
+
+class SparseFieldsetMixin:
+    """Оставляет в ответе поля из ?fields= без полей из ?omit=.
+
+    Поля отбираются только у сериализатора, созданного с контекстом
+    запроса (и у элементов many=True); вложенные сериализаторы
+    выводятся целиком.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = kwargs.get('context', {}).get('request')
+        if request is None:
+            return
+        keep = set(get_response_fields(request, tuple(self.fields)))
+        for name in tuple(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
@@ -1,23 +1,58 @@
-from django_filters.rest_framework import (ModelMultipleChoiceFilter,
-                                           BooleanFilter, FilterSet)
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            TrigramSimilarity)
+from django.db import connections
+from django.db.models import Case, Exists, F, OuterRef, Q, When
+from django.db.models.functions import Length, Lower
+from django_filters.rest_framework import (BooleanFilter, CharFilter,
+                                           FilterSet, MultipleChoiceFilter)
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import SearchFilter
 
-from recipes.models import Recipe, Tag
+from recipes.constants import SEARCH_CONFIG
+from recipes.models import Favorite, Recipe, ShoppingCart, TagInRecipe
+from .cache import tag_slugs
+from .pagination import CURSOR_PAGINATION_PARAM, CURSOR_PAGINATION_VALUE
 
 
 class IngredientFilter(SearchFilter):
-    """Поиск по названию ингредиента."""
+    """Поиск по началу названия ингредиента.
+
+    Значение ищется целиком, без разбиения на слова, а результаты
+    сортируются как в префиксном индексе (api.autocomplete): сначала
+    точное совпадение, затем более короткие названия.
+    """
 
     search_param = 'name'
 
+    def get_search_terms(self, request):
+        name = request.query_params.get(self.search_param, '')
+        name = name.replace('\x00', '').strip()
+        return [name] if name else []
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return super().filter_queryset(request, queryset, view).order_by(
+            Case(When(name__iexact=terms[0], then=0), default=1),
+            Length('name'),
+            Lower('name'),
+            'id'
+        )
+
+
+def tag_choices():
+    """Слаги тегов из памяти; вызывается при проверке значения фильтра."""
+
+    return tag_slugs.choices()
+
 
 class RecipeFilter(FilterSet):
     """Фильтр для рецептов."""
 
-    tags = ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug',
-        to_field_name='slug')
+    tags = MultipleChoiceFilter(
+        choices=tag_choices,
+        method='tags_filter')
 
     is_favorited = BooleanFilter(
         method='is_recipe_in_favorites_filter'
@@ -25,6 +60,7 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = BooleanFilter(
         method='is_recipe_in_shoppingcart_filter'
     )
+    search = CharFilter(method='search_filter')
 
     class Meta:
         model = Recipe
@@ -32,18 +68,68 @@ class RecipeFilter(FilterSet):
             'tags',
             'author',
             'is_favorited',
-            'is_in_shopping_cart'
-
+            'is_in_shopping_cart',
+            'search',
         ]
 
+    def tags_filter(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов.
+
+        Полусоединение через EXISTS не размножает строки рецептов,
+        в отличие от JOIN по тегам, а id тегов берутся из памяти.
+        """
+
+        return queryset.filter(Exists(TagInRecipe.objects.filter(
+            recipe=OuterRef('pk'), tag_id__in=tag_slugs.get_ids(value)
+        )))
+
+    def user_recipe_filter(self, queryset, model):
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset.none()
+        return queryset.filter(Exists(model.objects.filter(
+            user=user, recipe=OuterRef('pk')
+        )))
+
     def is_recipe_in_favorites_filter(self, queryset, name, value):
         if value == 1:
-            user = self.request.user
-            return queryset.filter(favorite__user_id=user.id)
+            return self.user_recipe_filter(queryset, Favorite)
         return queryset
 
     def is_recipe_in_shoppingcart_filter(self, queryset, name, value):
         if value == 1:
-            user = self.request.user
-            return queryset.filter(shoppingcart__user_id=user.id)
+            return self.user_recipe_filter(queryset, ShoppingCart)
         return queryset
+
+    def search_filter(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию рецепта.
+
+        В PostgreSQL используется поисковый вектор и триграммы для
+        нечеткого совпадения названия, результаты сортируются по
+        релевантности. На других базах выполняется поиск по подстроке.
+        Курсорная пагинация сортирует по дате публикации и отбросила бы
+        релевантность, поэтому вместе с поиском она запрещена.
+        """
+
+        value = value.strip()
+        if not value:
+            return queryset
+        if (
+            self.request.query_params.get(CURSOR_PAGINATION_PARAM)
+            == CURSOR_PAGINATION_VALUE
+        ):
+            raise ValidationError({
+                name: 'Поиск не поддерживает курсорную пагинацию.'
+            })
+        if connections[queryset.db].vendor != 'postgresql':
+            return queryset.filter(
+                Q(name__icontains=value) | Q(text__icontains=value)
+            )
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(
+            Q(search_vector=query) | Q(name__trigram_similar=value)
+        ).annotate(
+            rank=SearchRank(F('search_vector'), query)
+            + TrigramSimilarity('name', value)
+        ).order_by('-rank', 'id')
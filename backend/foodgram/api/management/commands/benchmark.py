@@ -0,0 +1,152 @@
+import random
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from api.benchmark import (HttpTransport, LocalTransport, format_report,
+                           run_load)
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+from .generate_dataset import (SYNTHETIC_DISHES, SYNTHETIC_FILLINGS,
+                               USERNAME_PREFIX)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сценарии нагрузочного теста по синтетическим данным '
+        '(generate_dataset): пропускная способность и задержки '
+        'p50/p95/p99 для каждого сценария. Без --base-url запросы '
+        'выполняются в текущем процессе без HTTP-сервера.'
+    )
+
+    scenarios = (
+        'recipe_list',
+        'recipe_list_filtered',
+        'recipe_detail',
+        'subscriptions',
+        'download_shopping_cart',
+        'ingredient_autocomplete',
+        'recipe_search',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url',
+            help='Адрес запущенного сервера, например http://localhost:8000'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='Количество запросов на сценарий'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Количество одновременных клиентов'
+        )
+        parser.add_argument(
+            '--scenario',
+            action='append',
+            choices=self.scenarios,
+            help='Запустить только указанные сценарии'
+        )
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=50,
+            help='Количество пользователей, от имени которых идут запросы'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Зерно генератора случайных чисел'
+        )
+
+    def handle(self, *args, **kwargs):
+        self.rng = random.Random(kwargs['seed'])
+        users = list(User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).order_by('?').values_list('pk', flat=True)[:kwargs['users']])
+        if not users:
+            raise CommandError(
+                'Нет синтетических данных, запустите generate_dataset.'
+            )
+        self.tokens = [
+            Token.objects.get_or_create(user_id=user_id)[0].key
+            for user_id in users
+        ]
+        self.recipe_ids = list(Recipe.objects.filter(
+            author__username__startswith=USERNAME_PREFIX
+        ).values_list('pk', flat=True))
+        self.tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.prefixes = sorted({
+            name[:length].lower()
+            for name in Ingredient.objects.values_list('name', flat=True)
+            for length in (1, 2, 3)
+        })
+
+        if kwargs['base_url']:
+            transport = HttpTransport(kwargs['base_url'])
+        else:
+            transport = LocalTransport()
+        total: int = kwargs['requests']
+        for name in kwargs['scenario'] or self.scenarios:
+            # Адреса готовятся заранее, чтобы генерация не влияла
+            # на замер и повторялась при том же зерне.
+            paths = [getattr(self, name)() for _ in range(total)]
+            elapsed, latencies, errors = run_load(
+                lambda number: transport.get(*paths[number]),
+                total,
+                kwargs['concurrency']
+            )
+            style = self.style.SUCCESS if latencies else self.style.ERROR
+            self.stdout.write(style(
+                f'{name}: ' + format_report(total, elapsed, latencies, errors)
+            ))
+
+    def token(self):
+        return self.rng.choice(self.tokens)
+
+    def recipe_list(self):
+        page = self.rng.randint(1, 10)
+        return f'/api/recipes/?page={page}&limit=6', self.token()
+
+    def recipe_list_filtered(self):
+        tags = '&'.join(
+            f'tags={slug}' for slug in self.rng.sample(
+                self.tag_slugs, min(len(self.tag_slugs), 2)
+            )
+        )
+        flag = self.rng.choice(('is_favorited', 'is_in_shopping_cart'))
+        return f'/api/recipes/?{tags}&{flag}=1&limit=6', self.token()
+
+    def recipe_detail(self):
+        recipe_id = self.rng.choice(self.recipe_ids)
+        return f'/api/recipes/{recipe_id}/', self.token()
+
+    def subscriptions(self):
+        return '/api/users/subscriptions/?recipes_limit=3', self.token()
+
+    def download_shopping_cart(self):
+        return '/api/recipes/download_shopping_cart/', self.token()
+
+    def ingredient_autocomplete(self):
+        prefix = self.rng.choice(self.prefixes)
+        return f'/api/ingredients/?name={prefix}', self.token()
+
+    def recipe_search(self):
+        """Полнотекстовый запрос, запрос с опечаткой в названии
+        (триграммы) или название с начинкой."""
+
+        dish = self.rng.choice(SYNTHETIC_DISHES)
+        value = self.rng.choice((
+            dish,
+            dish[:-1] + 'ы',
+            f'{dish} {self.rng.choice(SYNTHETIC_FILLINGS)}',
+        ))
+        query = urlencode({'search': value, 'limit': 6})
+        return f'/api/recipes/?{query}', self.token()
@@ -0,0 +1,102 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from api.benchmark import format_report, run_load
+from foodgram.postgresql.pool import close_pools, connection_stats
+from recipes.models import Tag
+
+
+class Command(BaseCommand):
+    help = (
+        'Стоимость соединения с базой на запрос: цикл HTTP-запроса '
+        '(сигналы request_started/request_finished и один SQL-запрос) '
+        'без постоянных соединений, с постоянными соединениями '
+        'и с пулом процесса.'
+    )
+
+    modes = {
+        'close': {'CONN_MAX_AGE': 0, 'POOL_SIZE': 0},
+        'persistent': {'CONN_MAX_AGE': 60, 'POOL_SIZE': 0},
+        'pool': {'CONN_MAX_AGE': 60},
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Количество запросов на режим'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Количество потоков'
+        )
+        parser.add_argument(
+            '--pool-size',
+            type=int,
+            default=4,
+            help='Размер пула в режиме pool'
+        )
+        parser.add_argument(
+            '--mode',
+            action='append',
+            choices=self.modes,
+            help='Запустить только указанные режимы'
+        )
+
+    def handle(self, *args, **kwargs):
+        settings_dict = connections.databases[DEFAULT_DB_ALIAS]
+        if not settings_dict['ENGINE'].startswith('foodgram.postgresql'):
+            raise CommandError('Нужна база с ENGINE foodgram.postgresql.')
+        original = dict(settings_dict)
+        total: int = kwargs['requests']
+        try:
+            for mode in kwargs['mode'] or self.modes:
+                connections.close_all()
+                close_pools()
+                settings_dict.update(self.modes[mode])
+                if mode == 'pool':
+                    settings_dict['POOL_SIZE'] = kwargs['pool_size']
+                before = connection_stats.snapshot().get(DEFAULT_DB_ALIAS, {})
+                elapsed, latencies, errors = run_load(
+                    self.request_cycle, total, kwargs['concurrency']
+                )
+                after = connection_stats.snapshot().get(DEFAULT_DB_ALIAS, {})
+                opened = after.get('opened', 0) - before.get('opened', 0)
+                connect_seconds = (
+                    after.get('connect_seconds', 0)
+                    - before.get('connect_seconds', 0)
+                )
+                wait_seconds = (
+                    after.get('checkout_wait_seconds', 0)
+                    - before.get('checkout_wait_seconds', 0)
+                )
+                self.stdout.write(self.style.SUCCESS(
+                    f'{mode}: ' + format_report(
+                        total, elapsed, latencies, errors
+                    )
+                ))
+                self.stdout.write(
+                    f'  соединений открыто: {opened}, '
+                    f'подключение на запрос: '
+                    f'{connect_seconds / total * 1000:.2f} мс, '
+                    f'ожидание пула на запрос: '
+                    f'{wait_seconds / total * 1000:.2f} мс'
+                )
+        finally:
+            connections.close_all()
+            close_pools()
+            settings_dict.clear()
+            settings_dict.update(original)
+
+    @staticmethod
+    def request_cycle(number):
+        request_started.send(sender=Command)
+        try:
+            Tag.objects.order_by().values_list('pk', flat=True).first()
+        finally:
+            request_finished.send(sender=Command)
+        return True
@@ -0,0 +1,124 @@
+import json
+import time
+from statistics import median
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.renderers import ORJSONRenderer
+from api.views import RecipeViewSet
+from recipes.models import Recipe
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Микробенчмарк списка рецептов: RecipeSerializer с JSONRenderer '
+        'против RecipeRowSerializer с ORJSONRenderer. Время SQL, '
+        'сериализации без SQL и рендеринга замеряется отдельно, вывод '
+        'обоих вариантов сверяется.'
+    )
+
+    variants = (
+        ('RecipeSerializer + JSONRenderer', False, JSONRenderer()),
+        ('RecipeRowSerializer + ORJSONRenderer', True, ORJSONRenderer()),
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10, 100, 1000],
+            help='Размеры списка'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Количество повторов, в отчете медиана'
+        )
+        parser.add_argument(
+            '--username',
+            help='Пользователь, от имени которого строится список; '
+                 'по умолчанию анонимный'
+        )
+
+    def handle(self, *args, **kwargs):
+        user = AnonymousUser()
+        if kwargs['username']:
+            user = User.objects.filter(username=kwargs['username']).first()
+            if user is None:
+                raise CommandError('Пользователь не найден.')
+        available = Recipe.objects.count()
+        if available < max(kwargs['sizes']):
+            self.stdout.write(self.style.WARNING(
+                f'В базе {available} рецептов, большие списки будут '
+                f'короче; сгенерируйте данные командой generate_dataset.'
+            ))
+        for size in kwargs['sizes']:
+            outputs = []
+            for name, fast, renderer in self.variants:
+                timings = [
+                    self.measure(user, size, fast, renderer)
+                    for _ in range(kwargs['repeat'])
+                ]
+                sql, serialize, render = (
+                    median(column) for column in zip(*(
+                        timing[:3] for timing in timings
+                    ))
+                )
+                content = timings[-1][3]
+                outputs.append(content)
+                self.stdout.write(
+                    f'{size}: {name}: SQL {sql * 1000:.1f} мс, '
+                    f'сериализация {serialize * 1000:.1f} мс, '
+                    f'рендеринг {render * 1000:.1f} мс, '
+                    f'{len(content)} байт'
+                )
+            if self.normalize(outputs[0]) != self.normalize(outputs[1]):
+                self.stdout.write(self.style.ERROR(
+                    f'{size}: вывод сериализаторов различается'
+                ))
+
+    def measure(self, user, size, fast, renderer):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        view = RecipeViewSet(
+            request=request, action='list', format_kwarg=None,
+            args=(), kwargs={}
+        )
+        view.use_row_serializer = lambda: fast
+        sql_time = 0.0
+
+        def timer(execute, sql, params, many, context):
+            nonlocal sql_time
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                sql_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            data = view.get_serializer(
+                view.get_queryset()[:size], many=True
+            ).data
+        serialized = time.perf_counter()
+        content = renderer.render(data)
+        finished = time.perf_counter()
+        return (sql_time, serialized - started - sql_time,
+                finished - serialized, content)
+
+    @staticmethod
+    def normalize(content):
+        """Ингредиенты читаются без сортировки, порядок не сравнивается."""
+
+        recipes = json.loads(content)
+        for recipe in recipes:
+            recipe['ingredients'].sort(key=lambda item: item['id'])
+        return recipes
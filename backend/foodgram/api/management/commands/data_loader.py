@@ -1,10 +1,18 @@
 import csv
+import io
 import json
+import time
+from itertools import islice
 
-from django.core.management.base import BaseCommand
-from django.db import models, transaction
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, models, transaction
 from django.utils import termcolors
 
+from api.autocomplete import ingredient_index
+from api.cache import bump_response_generation
+
+BATCH_SIZE = 1000
+
 
 class Command(BaseCommand):
     data = [
@@ -12,12 +20,14 @@ class Command(BaseCommand):
             'file_name': 'ingredients',
             'model': 'recipes.Ingredient',
             'fields': ['name', 'measurement_unit'],
+            'unique_fields': ['name', 'measurement_unit'],
             'type': 'csv'
         },
         {
             'file_name': 'tags',
             'model': 'recipes.Tag',
             'fields': ['name', 'slug'],
+            'unique_fields': ['slug'],
             'type': 'json'
         }
         # Добавьте другие файлы, если нужно
@@ -36,23 +46,34 @@ class Command(BaseCommand):
             default='all',
             help='Тип файла для загрузки: csv, json, или all (все файлы)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help='Количество строк, записываемых за один запрос'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Прочитать и записать данные, затем откатить транзакцию'
+        )
 
-    @transaction.atomic
     def handle(self, *args, **kwargs):
         from django.apps import apps
 
         file_type: str = kwargs['file_type'].lower()
+        batch_size: int = kwargs['batch_size']
+        dry_run: bool = kwargs['dry_run']
 
         # Определяем, какие типы файлов обрабатывать
         valid_file_types = {'csv', 'json', 'all'}
         if file_type not in valid_file_types:
-            self.stderr.write(self.style.ERROR(
+            raise CommandError(
                 f'Неверный тип: {file_type}. Доступны к выбору: csv, json, '
                 'all (по умолчанию, работает как с csv, так и json).'
-            ))
-            return
+            )
 
-        try:
+        with transaction.atomic():
             for entry in self.data:
                 if file_type != 'all' and entry['type'] != file_type:
                     self.stderr.write(self.style.WARNING(
@@ -67,46 +88,172 @@ class Command(BaseCommand):
                 file_path = f'data/{file_name}.{type_name}'
                 model = apps.get_model(model_name)
                 fields: list = entry['fields']
+                unique_fields: list = entry['unique_fields']
                 self.stdout.write(self.style.NOTICE(
                     f'Обработка файла: {file_path} для модели: '
                     f'{model_name} ({type_name})'
                 ))
 
                 # Загружаем данные в зависимости от типа файла
-                if entry['type'] == 'csv':
-                    self.load_csv(file_path, model, fields)
-                elif entry['type'] == 'json':
-                    self.load_json(file_path, model, fields)
+                if type_name == 'csv':
+                    rows = self.read_csv(file_path, fields)
+                else:
+                    rows = self.read_json(file_path, fields)
 
-            self.stdout.write(self.style.SUCCESS(
-                f'Данные успешно загружены из: {type_name}'
-            ))
+                started = time.monotonic()
+                try:
+                    total, written = self.load(
+                        model, fields, unique_fields, rows, batch_size
+                    )
+                except (OSError, ValueError, KeyError, DatabaseError) as e:
+                    raise CommandError(
+                        f'Ошибка загрузки данных из {file_path}: {e!r}'
+                    ) from e
+                elapsed = max(time.monotonic() - started, 1e-6)
+                self.stdout.write(self.style.SUCCESS(
+                    f'Данные успешно загружены из: {file_path}. '
+                    f'Прочитано строк: {total}, записано: {written}, '
+                    f'{total / elapsed:.0f} строк/с'
+                ))
 
-        except Exception as e:
-            self.stderr.write(self.style.ERROR(f'Ошибка загрузки данных: {e}'))
+            if dry_run:
+                transaction.set_rollback(True)
+                self.stdout.write(self.style.WARNING(
+                    'Пробный запуск: изменения отменены.'
+                ))
+        if not dry_run:
+            # Пакетная запись идет мимо сигналов моделей, поэтому индекс
+            # ингредиентов, слаги тегов и кэш ответов сбрасываются здесь.
+            # Веб-процессы без общего кэша увидят изменения по истечении
+            # INGREDIENT_INDEX_TTL и TAG_SLUGS_TTL.
+            ingredient_index.invalidate()
+            bump_response_generation('ingredients', 'tags', 'recipes')
 
-    def load_csv(self, file_path: str, model: models.Model, fields: list):
-        """Обработка CSV-файла."""
+    def read_csv(self, file_path: str, fields: list):
+        """Построчное чтение CSV-файла."""
 
         with open(file_path, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                data = {fields[i]: row[i] for i in range(len(fields))}
-                model.objects.update_or_create(
-                    **{fields[0]: data[fields[0]]},
-                    defaults=data
-                )
+            for row in csv.reader(file):
+                if len(row) != len(fields):
+                    raise ValueError(f'Неверная строка CSV: {row}')
+                yield dict(zip(fields, row))
 
-    def load_json(self, file_path: str, model: models.Model, fields: list):
-        """Обработка JSON-файла."""
+    def read_json(self, file_path: str, fields: list):
+        """Чтение JSON-файла со списком объектов."""
 
         with open(file_path, mode='r', encoding='utf-8') as file:
             data = json.load(file)
-            for item in data:
-                model_data = {
-                    field: item[field] for field in fields if field in item
-                }
-                model.objects.update_or_create(
-                    **{fields[0]: model_data[fields[0]]},
-                    defaults=model_data
+        for item in data:
+            yield {field: item[field] for field in fields}
+
+    def load(self, model: models.Model, fields: list, unique_fields: list,
+             rows, batch_size: int):
+        """Пакетная идемпотентная запись строк.
+
+        Возвращает количество прочитанных и записанных строк.
+        """
+
+        batches = iter(lambda: list(islice(rows, batch_size)), [])
+        if connection.vendor == 'postgresql':
+            return self.copy_upsert(model, fields, unique_fields, batches)
+        total = written = 0
+        for batch in batches:
+            total += len(batch)
+            written += self.bulk_upsert(model, fields, unique_fields, batch)
+        return total, written
+
+    def bulk_upsert(self, model: models.Model, fields: list,
+                    unique_fields: list, batch: list):
+        """Запись пакета через ORM: один SELECT, UPDATE и INSERT."""
+
+        update_fields = [
+            field for field in fields if field not in unique_fields
+        ]
+        rows = {
+            tuple(row[field] for field in unique_fields): row
+            for row in batch
+        }
+        existing = {
+            tuple(getattr(obj, field) for field in unique_fields): obj
+            for obj in model.objects.filter(**{
+                f'{unique_fields[0]}__in': {key[0] for key in rows}
+            })
+        }
+        to_create = []
+        to_update = []
+        for key, row in rows.items():
+            obj = existing.get(key)
+            if obj is None:
+                to_create.append(model(**row))
+            elif any(getattr(obj, field) != row[field]
+                     for field in update_fields):
+                for field in update_fields:
+                    setattr(obj, field, row[field])
+                to_update.append(obj)
+        model.objects.bulk_create(to_create, ignore_conflicts=True)
+        if to_update:
+            model.objects.bulk_update(to_update, update_fields)
+        return len(to_create) + len(to_update)
+
+    def copy_upsert(self, model: models.Model, fields: list,
+                    unique_fields: list, batches):
+        """Запись в PostgreSQL через COPY во временную таблицу
+        и INSERT ... ON CONFLICT."""
+
+        quote = connection.ops.quote_name
+        table = quote(model._meta.db_table)
+        temp_table = quote(f'tmp_{model._meta.db_table}')
+        columns = ', '.join(
+            quote(model._meta.get_field(field).column) for field in fields
+        )
+        unique_columns = ', '.join(
+            quote(model._meta.get_field(field).column)
+            for field in unique_fields
+        )
+        update_columns = [
+            quote(model._meta.get_field(field).column)
+            for field in fields if field not in unique_fields
+        ]
+        if update_columns:
+            # Совпадающие строки не перезаписываются: повторная загрузка
+            # не создает новых версий строк и не считается записью.
+            current = ', '.join(
+                f'{table}.{column}' for column in update_columns
+            )
+            excluded = ', '.join(
+                f'EXCLUDED.{column}' for column in update_columns
+            )
+            conflict = 'DO UPDATE SET ' + ', '.join(
+                f'{column} = EXCLUDED.{column}' for column in update_columns
+            ) + f' WHERE ({current}) IS DISTINCT FROM ({excluded})'
+        else:
+            conflict = 'DO NOTHING'
+
+        total = 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE {temp_table} ON COMMIT DROP AS '
+                f'SELECT {columns} FROM {table} WITH NO DATA'
+            )
+            for batch in batches:
+                total += len(batch)
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(
+                    [row[field] for field in fields] for row in batch
+                )
+                buffer.seek(0)
+                cursor.copy_expert(
+                    f'COPY {temp_table} ({columns}) FROM STDIN '
+                    'WITH (FORMAT csv)',
+                    buffer
                 )
+            cursor.execute(
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT DISTINCT ON ({unique_columns}) {columns} '
+                f'FROM {temp_table} '
+                f'ON CONFLICT ({unique_columns}) {conflict}'
+            )
+            written = cursor.rowcount
+            cursor.execute(f'DROP TABLE {temp_table}')
+        return total, written
@@ -0,0 +1,326 @@
+import io
+import random
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from recipes.models import (Favorite, Follow, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, Tag, TimelineEntry)
+from recipes.signals import update_search_vectors
+
+User = get_user_model()
+
+USERNAME_PREFIX = 'bench_'
+IMAGE_NAME = 'recipes/benchmark.png'
+PASSWORD = 'benchmark'
+SYNTHETIC_INGREDIENTS = 2000
+SYNTHETIC_TAGS = (
+    ('Завтрак', 'breakfast'), ('Обед', 'lunch'), ('Ужин', 'dinner'),
+)
+# Названия рецептов для сценария поиска в benchmark.
+SYNTHETIC_DISHES = (
+    'Борщ', 'Суп', 'Солянка', 'Плов', 'Пирог', 'Запеканка', 'Салат',
+    'Котлеты', 'Блины', 'Сырники', 'Омлет', 'Рагу', 'Каша', 'Пельмени',
+)
+SYNTHETIC_FILLINGS = (
+    'с курицей', 'с говядиной', 'с грибами', 'с рыбой', 'с сыром',
+    'с яблоками', 'с картофелем', 'с овощами', 'с творогом', 'с рисом',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Генерация синтетических данных для нагрузочного тестирования: '
+        'пользователи, рецепты, подписки, избранное и корзины. '
+        f'Пароль всех пользователей - "{PASSWORD}".'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=1000,
+            help='Количество пользователей'
+        )
+        parser.add_argument(
+            '--recipes',
+            type=int,
+            default=10,
+            help='Среднее количество рецептов на пользователя'
+        )
+        parser.add_argument(
+            '--follows',
+            type=int,
+            default=20,
+            help='Среднее количество подписок пользователя'
+        )
+        parser.add_argument(
+            '--favorites',
+            type=int,
+            default=30,
+            help='Среднее количество рецептов в избранном пользователя'
+        )
+        parser.add_argument(
+            '--carts',
+            type=int,
+            default=5,
+            help='Среднее количество рецептов в корзине пользователя'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Зерно генератора случайных чисел'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк, записываемых за один запрос'
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Удалить ранее сгенерированных пользователей и их данные'
+        )
+
+    def handle(self, *args, **kwargs):
+        self.rng = random.Random(kwargs['seed'])
+        self.batch_size: int = kwargs['batch_size']
+        started = time.monotonic()
+
+        with transaction.atomic():
+            if kwargs['clear']:
+                deleted, _ = User.objects.filter(
+                    username__startswith=USERNAME_PREFIX
+                ).delete()
+                self.stdout.write(f'Удалено объектов: {deleted}')
+            elif User.objects.filter(
+                username__startswith=USERNAME_PREFIX
+            ).exists():
+                raise CommandError(
+                    'Синтетические данные уже есть, используйте --clear.'
+                )
+
+            ingredient_ids = self.get_ingredient_ids()
+            tag_ids = self.get_tag_ids()
+            user_ids = self.create_users(kwargs['users'])
+            # Популярность авторов распределена по закону Ципфа:
+            # немногие авторы собирают большую часть подписок и лайков.
+            weights = [1 / rank for rank in range(1, len(user_ids) + 1)]
+            recipes = self.create_recipes(
+                user_ids, weights, kwargs['recipes']
+            )
+            self.create_recipe_relations(recipes, ingredient_ids, tag_ids)
+            follows = self.create_follows(user_ids, weights, kwargs['follows'])
+            recipe_ids = [pk for pk, _, _ in recipes]
+            recipe_weights = [
+                weights[index] for index in self.recipe_author_ranks(
+                    recipes, user_ids
+                )
+            ]
+            for model, average in (
+                (Favorite, kwargs['favorites']),
+                (ShoppingCart, kwargs['carts']),
+            ):
+                self.create_user_recipes(
+                    model, user_ids, recipe_ids, recipe_weights, average
+                )
+            self.create_timeline(recipes, follows)
+            update_search_vectors(Recipe.objects.filter(author__in=user_ids))
+        call_command('recount', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Сгенерировано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipes)}, подписок: {len(follows)} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+
+    def get_ingredient_ids(self):
+        """Существующие ингредиенты или синтетические, если их нет."""
+
+        if not Ingredient.objects.exists():
+            Ingredient.objects.bulk_create(
+                (
+                    Ingredient(name=f'Ингредиент {number}',
+                               measurement_unit='г')
+                    for number in range(SYNTHETIC_INGREDIENTS)
+                ),
+                batch_size=self.batch_size
+            )
+        return list(Ingredient.objects.values_list('pk', flat=True))
+
+    def get_tag_ids(self):
+        """Существующие теги или синтетические, если их нет."""
+
+        if not Tag.objects.exists():
+            Tag.objects.bulk_create(
+                Tag(name=name, slug=slug) for name, slug in SYNTHETIC_TAGS
+            )
+        return list(Tag.objects.values_list('pk', flat=True))
+
+    def get_image(self):
+        """Одна картинка на все рецепты, чтобы не раздувать MEDIA_ROOT."""
+
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = io.BytesIO()
+            Image.new('RGB', (64, 64), (200, 120, 60)).save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+        return IMAGE_NAME
+
+    def create_users(self, count: int):
+        password = make_password(PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{USERNAME_PREFIX}{number}',
+                    email=f'{USERNAME_PREFIX}{number}@example.com',
+                    first_name='Пользователь',
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(count)
+            ),
+            batch_size=self.batch_size
+        )
+        return list(User.objects.filter(
+            username__startswith=USERNAME_PREFIX
+        ).order_by('pk').values_list('pk', flat=True))
+
+    def create_recipes(self, user_ids: list, weights: list, average: int):
+        """Рецепты со случайными датами публикации за последний год.
+
+        Возвращает список (pk, author_id, pub_date).
+        """
+
+        image = self.get_image()
+        now = timezone.now()
+        authors = self.rng.choices(
+            user_ids, weights=weights, k=len(user_ids) * average
+        )
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=author_id,
+                    name=f'{self.rng.choice(SYNTHETIC_DISHES)} '
+                         f'{self.rng.choice(SYNTHETIC_FILLINGS)} {number}',
+                    text='Синтетический рецепт для нагрузочного теста. ' * 5,
+                    image=image,
+                    cooking_time=self.rng.randint(5, 180),
+                    pub_date=now - timedelta(
+                        seconds=self.rng.randint(0, 365 * 24 * 60 * 60)
+                    ),
+                )
+                for number, author_id in enumerate(authors)
+            ),
+            batch_size=self.batch_size
+        )
+        return list(Recipe.objects.filter(
+            author__in=user_ids
+        ).values_list('pk', 'author_id', 'pub_date').order_by('pk'))
+
+    def recipe_author_ranks(self, recipes: list, user_ids: list):
+        ranks = {user_id: rank for rank, user_id in enumerate(user_ids)}
+        return [ranks[author_id] for _, author_id, _ in recipes]
+
+    def create_recipe_relations(self, recipes: list, ingredient_ids: list,
+                                tag_ids: list):
+        """От 3 до 15 ингредиентов и от 1 до 3 тегов на рецепт."""
+
+        ingredients = []
+        tags = []
+        for recipe_id, _, _ in recipes:
+            ingredients.extend(
+                IngredientInRecipe(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500),
+                )
+                for ingredient_id in self.rng.sample(
+                    ingredient_ids, min(len(ingredient_ids),
+                                        self.rng.randint(3, 15))
+                )
+            )
+            tags.extend(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for tag_id in self.rng.sample(
+                    tag_ids, min(len(tag_ids), self.rng.randint(1, 3))
+                )
+            )
+        IngredientInRecipe.objects.bulk_create(
+            ingredients, batch_size=self.batch_size
+        )
+        Recipe.tags.through.objects.bulk_create(
+            tags, batch_size=self.batch_size
+        )
+
+    def sample_weighted(self, population: list, weights: list, count: int,
+                        exclude=None):
+        """До count различных элементов с учетом весов."""
+
+        chosen = set(self.rng.choices(population, weights=weights, k=count))
+        chosen.discard(exclude)
+        return chosen
+
+    def create_follows(self, user_ids: list, weights: list, average: int):
+        """Подписки; возвращает список пар (user_id, author_id)."""
+
+        follows = [
+            (user_id, author_id)
+            for user_id in user_ids
+            for author_id in self.sample_weighted(
+                user_ids, weights, self.rng.randint(0, average * 2),
+                exclude=user_id
+            )
+        ]
+        Follow.objects.bulk_create(
+            (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in follows
+            ),
+            batch_size=self.batch_size
+        )
+        return follows
+
+    def create_user_recipes(self, model, user_ids: list, recipe_ids: list,
+                            weights: list, average: int):
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in user_ids
+                for recipe_id in self.sample_weighted(
+                    recipe_ids, weights, self.rng.randint(0, average * 2)
+                )
+            ),
+            batch_size=self.batch_size
+        )
+
+    def create_timeline(self, recipes: list, follows: list):
+        """Ленты подписчиков для авторов, чьи рецепты рассылаются при
+        публикации (см. FEED_FANOUT_LIMIT)."""
+
+        followers = {}
+        for user_id, author_id in follows:
+            followers.setdefault(author_id, []).append(user_id)
+        TimelineEntry.objects.bulk_create(
+            (
+                TimelineEntry(
+                    user_id=user_id, recipe_id=recipe_id, pub_date=pub_date
+                )
+                for recipe_id, author_id, pub_date in recipes
+                if len(followers.get(author_id, ()))
+                <= settings.FEED_FANOUT_LIMIT
+                for user_id in followers.get(author_id, ())
+            ),
+            batch_size=self.batch_size
+        )
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import HttpTransport, format_report, run_load
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочное тестирование запущенного сервера: пропускная '
+        'способность и задержки p50/p95/p99. Запустите для WSGI и ASGI '
+        '(SERVER_MODE=asgi) и сравните результаты.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'urls',
+            nargs='+',
+            help='Адреса, запрашиваемые по кругу'
+        )
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=1000,
+            help='Общее количество запросов'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=16,
+            help='Количество одновременных клиентов'
+        )
+        parser.add_argument(
+            '--token',
+            help='Токен пользователя для заголовка Authorization'
+        )
+
+    def handle(self, *args, **kwargs):
+        urls: list = kwargs['urls']
+        total: int = kwargs['requests']
+        transport = HttpTransport('')
+
+        elapsed, latencies, errors = run_load(
+            lambda number: transport.get(
+                urls[number % len(urls)], kwargs['token']
+            ),
+            total,
+            kwargs['concurrency']
+        )
+        if not latencies:
+            raise CommandError('Ни один запрос не выполнен успешно.')
+        self.stdout.write(self.style.SUCCESS(
+            format_report(total, elapsed, latencies, errors)
+        ))
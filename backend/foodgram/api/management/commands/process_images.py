@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.cache import bump_response_generation
+from recipes.images import claim_jobs, process_job
+from recipes.models import ImageJob
+
+
+class Command(BaseCommand):
+    help = 'Фоновая обработка изображений: миниатюры и перекодирование'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.IMAGE_WORKERS,
+            help='Количество потоков обработки'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Пауза в секундах, если очередь пуста'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать текущую очередь и завершиться'
+        )
+
+    def handle(self, *args, **kwargs):
+        workers: int = kwargs['workers']
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                jobs = claim_jobs(workers * 4)
+                if not jobs:
+                    if kwargs['once']:
+                        break
+                    time.sleep(kwargs['sleep'])
+                    continue
+                list(pool.map(process_job, jobs))
+                # Миниатюры записываются через update() без сигналов,
+                # поэтому кэш ответов сбрасывается здесь.
+                bump_response_generation('recipes')
+                failed = [job for job in jobs
+                          if job.status == ImageJob.FAILED]
+                self.stdout.write(
+                    f'Обработано изображений: {len(jobs)}, '
+                    f'с ошибкой: {len(failed)}'
+                )
+                for job in failed:
+                    self.stderr.write(self.style.ERROR(
+                        f'{job}: {job.error}'
+                    ))
@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Follow, Recipe, ShoppingCart
+
+User = get_user_model()
+
+
+def count_subquery(model, field):
+    """Подзапрос количества строк model, ссылающихся на внешний объект."""
+
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков избранного, корзины, рецептов и подписчиков'
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        recipes = Recipe.objects.update(
+            favorites_count=count_subquery(Favorite, 'recipe'),
+            carts_count=count_subquery(ShoppingCart, 'recipe'),
+        )
+        users = User.objects.update(
+            recipes_count=count_subquery(Recipe, 'author'),
+            followers_count=count_subquery(Follow, 'author'),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Счетчики пересчитаны: рецептов {recipes}, '
+            f'пользователей {users}'
+        ))
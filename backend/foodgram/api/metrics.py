@@ -0,0 +1,310 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from rest_framework import serializers
+
+from foodgram.postgresql.pool import collect as collect_connections
+from .middleware import HybridMiddleware
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+current_request = ContextVar('current_request_metrics', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Представление выполнило больше запросов, чем задано
+    в QUERY_BUDGETS."""
+
+
+class RequestMetrics:
+    """Замеры одного запроса: число и время SQL-запросов и фаз
+    обработки."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.endpoint = None
+        self.budget = None
+        self.render_started = None
+
+
+def query_timer(execute, sql, params, many, context):
+    """Обертка execute_wrapper, считающая запросы текущего запроса.
+
+    В строгом режиме запрос сверх бюджета не выполняется: исключение
+    откатывает транзакцию представления, а не приходит после того,
+    как его изменения уже зафиксированы.
+    """
+
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    if metrics.budget is not None and metrics.queries >= metrics.budget:
+        raise QueryBudgetExceeded(
+            f'{metrics.endpoint}: запрос сверх бюджета {metrics.budget}: '
+            f'{sql}'
+        )
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.sql_time += time.perf_counter() - started
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Подключает query_timer к каждому новому соединению с базой."""
+
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def timed_data(data):
+    """Свойство data сериализатора, замеряющее время вывода.
+
+    Запросы отложенных связей во время вывода уже учтены
+    в sql_seconds_total и вычитаются. data вложенных сериализаторов,
+    например из SerializerMethodField, повторно не считается.
+    """
+
+    def fget(serializer):
+        metrics = current_request.get()
+        if metrics is None or metrics.serializing:
+            return data.fget(serializer)
+        metrics.serializing = True
+        started = time.perf_counter()
+        sql_started = metrics.sql_time
+        try:
+            return data.fget(serializer)
+        finally:
+            metrics.serializing = False
+            metrics.serializer_time += max(
+                time.perf_counter() - started
+                - (metrics.sql_time - sql_started),
+                0.0
+            )
+
+    fget.timed = True
+    return property(fget)
+
+
+def install_serializer_timer():
+    """Подключает замер времени к выводу сериализаторов DRF."""
+
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        if not getattr(cls.data.fget, 'timed', False):
+            cls.data = timed_data(cls.data)
+
+
+def get_endpoint(request, view_func):
+    """Имя представления: класс и действие вьюсета или имя маршрута."""
+
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return request.resolver_match.view_name
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{cls.__name__}.{action}'
+
+
+class MetricsRegistry:
+    """Накопленные метрики процесса в формате Prometheus."""
+
+    metrics = (
+        ('requests_total', 'counter', 'Количество запросов'),
+        ('sql_queries_total', 'counter', 'Количество SQL-запросов'),
+        ('sql_seconds_total', 'counter', 'Время выполнения SQL'),
+        ('serializer_seconds_total', 'counter',
+         'Время сериализации ответа без учета SQL'),
+        ('render_seconds_total', 'counter', 'Время рендеринга ответа'),
+        ('request_seconds_total', 'counter', 'Общее время обработки'),
+        ('query_budget_exceeded_total', 'counter',
+         'Превышения бюджета SQL-запросов'),
+    )
+
+    connection_metrics = (
+        ('opened', 'db_connections_opened_total', 'counter',
+         'Открыто соединений с базой'),
+        ('connect_seconds', 'db_connect_seconds_total', 'counter',
+         'Время открытия соединений'),
+        ('health_check_failures', 'db_health_check_failures_total',
+         'counter', 'Разорванные соединения, найденные проверкой'),
+        ('checkouts', 'db_pool_checkouts_total', 'counter',
+         'Соединения, выданные пулом'),
+        ('checkout_wait_seconds', 'db_pool_checkout_wait_seconds_total',
+         'counter', 'Время ожидания соединения из пула'),
+        ('timeouts', 'db_pool_timeouts_total', 'counter',
+         'Отказы пула по таймауту'),
+        ('pool_size', 'db_pool_size', 'gauge', 'Размер пула'),
+        ('idle', 'db_pool_idle_connections', 'gauge',
+         'Свободные соединения пула'),
+        ('in_use', 'db_pool_in_use_connections', 'gauge',
+         'Занятые соединения пула'),
+        ('max_age_seconds', 'db_pool_connection_max_age_seconds', 'gauge',
+         'Возраст самого старого соединения пула'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._buckets = {}
+
+    def record(self, endpoint, method, status, timings):
+        labels = (endpoint, method, str(status))
+        with self._lock:
+            values = self._values.setdefault(
+                labels, dict.fromkeys((name for name, *_ in self.metrics), 0)
+            )
+            values['requests_total'] += 1
+            for name, value in timings.items():
+                values[name] += value
+            buckets = self._buckets.setdefault(
+                labels, [0] * len(LATENCY_BUCKETS)
+            )
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if timings['request_seconds_total'] <= bound:
+                    buckets[index] += 1
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus."""
+
+        with self._lock:
+            values = {
+                labels: dict(row) for labels, row in self._values.items()
+            }
+            buckets = {
+                labels: list(row) for labels, row in self._buckets.items()
+            }
+        lines = []
+        for name, kind, description in self.metrics:
+            lines.append(f'# HELP foodgram_{name} {description}')
+            lines.append(f'# TYPE foodgram_{name} {kind}')
+            for labels, row in values.items():
+                lines.append(
+                    f'foodgram_{name}{{{format_labels(labels)}}} {row[name]}'
+                )
+        name = 'foodgram_request_duration_seconds'
+        lines.append(f'# HELP {name} Распределение времени обработки')
+        lines.append(f'# TYPE {name} histogram')
+        for labels, row in buckets.items():
+            label_text = format_labels(labels)
+            for bound, count in zip(LATENCY_BUCKETS, row):
+                lines.append(
+                    f'{name}_bucket{{{label_text},le="{bound}"}} {count}'
+                )
+            total = values[labels]
+            lines.append(
+                f'{name}_bucket{{{label_text},le="+Inf"}} '
+                f'{total["requests_total"]}'
+            )
+            lines.append(
+                f'{name}_sum{{{label_text}}} '
+                f'{total["request_seconds_total"]}'
+            )
+            lines.append(
+                f'{name}_count{{{label_text}}} {total["requests_total"]}'
+            )
+        connections = collect_connections()
+        for key, name, kind, description in self.connection_metrics:
+            lines.append(f'# HELP foodgram_{name} {description}')
+            lines.append(f'# TYPE foodgram_{name} {kind}')
+            for alias, row in connections.items():
+                if key in row:
+                    lines.append(
+                        f'foodgram_{name}{{alias="{alias}"}} {row[key]}'
+                    )
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    endpoint, method, status = labels
+    return f'endpoint="{endpoint}",method="{method}",status="{status}"'
+
+
+registry = MetricsRegistry()
+
+
+class RequestMetricsMiddleware(HybridMiddleware):
+    """Замеры SQL и времени обработки по каждому представлению.
+
+    Результаты накапливаются в registry и отдаются в заголовке
+    Server-Timing. Время сериализации замеряет свойство data
+    сериализаторов DRF (install_serializer_timer). Превышение бюджета
+    из QUERY_BUDGETS пишется в лог и в метрики, а в строгом режиме
+    (QUERY_BUDGET_STRICT, включен в foodgram.test_settings) лишний
+    запрос завершается QueryBudgetExceeded.
+    """
+
+    def handle(self, request):
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def ahandle(self, request):
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        if metrics.endpoint is None:
+            return response
+
+        finished = time.perf_counter()
+        render_started = metrics.render_started or finished
+        timings = {
+            'sql_queries_total': metrics.queries,
+            'sql_seconds_total': metrics.sql_time,
+            'serializer_seconds_total': metrics.serializer_time,
+            'render_seconds_total': finished - render_started,
+            'request_seconds_total': finished - metrics.started,
+            'query_budget_exceeded_total': 0,
+        }
+        budget = settings.QUERY_BUDGETS.get(metrics.endpoint)
+        if budget is not None and metrics.queries > budget:
+            timings['query_budget_exceeded_total'] = 1
+            logger.warning(
+                f'{metrics.endpoint}: {metrics.queries} SQL-запросов '
+                f'при бюджете {budget}'
+            )
+        registry.record(
+            metrics.endpoint, request.method, response.status_code, timings
+        )
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = ', '.join((
+                f'db;dur={timings["sql_seconds_total"] * 1000:.1f};'
+                f'desc="{metrics.queries} queries"',
+                'serializer;dur='
+                f'{timings["serializer_seconds_total"] * 1000:.1f}',
+                f'render;dur={timings["render_seconds_total"] * 1000:.1f}',
+                f'total;dur={timings["request_seconds_total"] * 1000:.1f}',
+            ))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = current_request.get()
+        if metrics is not None:
+            metrics.endpoint = get_endpoint(request, view_func)
+            if settings.QUERY_BUDGET_STRICT:
+                metrics.budget = settings.QUERY_BUDGETS.get(metrics.endpoint)
+
+    def process_template_response(self, request, response):
+        metrics = current_request.get()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+        return response
@@ -0,0 +1,53 @@
+import asyncio
+from types import MethodType
+
+VIEW_HOOKS = ('process_view', 'process_template_response')
+
+
+def run_inline(method):
+    """Корутина, вызывающая быстрый синхронный хук без смены потока.
+
+    Остается связанным методом: Django берет из __self__ имя класса
+    для сообщений об ошибках.
+    """
+
+    async def hook(middleware, *args, **kwargs):
+        return method(*args, **kwargs)
+
+    return MethodType(hook, method.__self__)
+
+
+class HybridMiddleware:
+    """Основа middleware для синхронной и асинхронной цепочки.
+
+    В отличие от MiddlewareMixin, под ASGI запрос не переносится
+    в поток через sync_to_async: вызов возвращает корутину ahandle(),
+    а хуки process_view и process_template_response, которые
+    не обращаются к базе, выполняются прямо в цикле событий.
+    Наследники определяют handle() для WSGI и ahandle() для ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Так Django распознает экземпляр как асинхронный.
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+            for name in VIEW_HOOKS:
+                method = getattr(self, name, None)
+                if method is not None:
+                    setattr(self, name, run_inline(method))
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.ahandle(request)
+        return self.handle(request)
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    async def ahandle(self, request):
+        raise NotImplementedError
@@ -1,4 +1,15 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (CursorPagination, PageNumberPagination,
+                                       _reverse_ordering)
+from rest_framework.response import Response
+
+CURSOR_PAGINATION_PARAM = 'pagination'
+CURSOR_PAGINATION_VALUE = 'cursor'
 
 
 class CustomPagination(PageNumberPagination):
@@ -6,3 +17,208 @@ class CustomPagination(PageNumberPagination):
 
     page_size_query_param = 'limit'
     page_size = 6
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по статистике PostgreSQL.
+
+    Возвращает None для других баз и для отфильтрованных выборок,
+    где оценка по всей таблице была бы неверной.
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or queryset.query.where:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            (queryset.model._meta.db_table,)
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Курсор по всем полям сортировки, а не только по первому.
+
+    CursorPagination из DRF хранит в курсоре значение первого поля
+    и пропускает строки с тем же значением через OFFSET, поэтому при
+    совпадающих датах дальние страницы дороже первой. Здесь позиция —
+    значения всех полей сортировки (последнее поле уникально), а
+    страница после нее выбирается построчным сравнением (a, b) < (x, y)
+    по индексу, без OFFSET.
+    """
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            values = (instance[order.lstrip('-')] for order in ordering)
+        else:
+            values = (getattr(instance, order.lstrip('-'))
+                      for order in ordering)
+        return json.dumps([str(value) for value in values])
+
+    def decode_position(self, position, model):
+        """Значения позиции, приведенные к типам полей сортировки.
+
+        Курсор приходит от клиента, поэтому испорченная позиция дает
+        404, как и испорченный курсор, а не ошибку в запросе к базе.
+        """
+
+        try:
+            values = json.loads(position)
+            if (
+                not isinstance(values, list)
+                or len(values) != len(self.ordering)
+            ):
+                raise ValueError(position)
+            values = [
+                model._meta.get_field(order.lstrip('-')).to_python(value)
+                for order, value in zip(self.ordering, values)
+            ]
+            if None in values:
+                raise ValueError(position)
+            return values
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def filter_after(self, queryset, values, reverse):
+        """Строки после позиции values в порядке выдачи.
+
+        Сравнение кортежей раскрыто в (a < x) OR (a = x AND b < y),
+        а условие a <= x по первому полю ограничивает диапазон индекса.
+        """
+
+        lookups = [
+            (order.lstrip('-'),
+             'lt' if reverse != order.startswith('-') else 'gt')
+            for order in self.ordering
+        ]
+        after = Q()
+        equal = {}
+        for (attr, lookup), value in zip(lookups, values):
+            after |= Q(**equal, **{f'{attr}__{lookup}': value})
+            equal[attr] = value
+        attr, lookup = lookups[0]
+        return queryset.filter(
+            Q(**{f'{attr}__{lookup}e': values[0]}) & after
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Повторяет CursorPagination.paginate_queryset, кроме фильтра
+        # по позиции курсора.
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*_reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            queryset = self.filter_after(
+                queryset,
+                self.decode_position(current_position, queryset.model),
+                reverse
+            )
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+
+class EstimatedCountCursorPagination(KeysetCursorPagination):
+    """Пагинация по ключу без COUNT(*) и OFFSET.
+
+    Вместо точного количества отдается оценка, если она доступна.
+    """
+
+    page_size = 6
+    page_size_query_param = 'limit'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = estimate_count(queryset)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.count,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+
+class RecipeCursorPagination(EstimatedCountCursorPagination):
+    """Курсорная пагинация рецептов по дате публикации и id."""
+
+    ordering = ('-pub_date', '-id')
+
+
+class SubscriptionCursorPagination(EstimatedCountCursorPagination):
+    """Курсорная пагинация подписок."""
+
+    ordering = ('id',)
+
+
+class CursorPaginationMixin:
+    """Включает курсорную пагинацию по параметру ?pagination=cursor.
+
+    Курсорный пагинатор задается для действий в cursor_pagination_classes,
+    для остальных используется pagination_class.
+    """
+
+    cursor_pagination_classes = {}
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            cursor_class = self.cursor_pagination_classes.get(self.action)
+            if (
+                cursor_class is not None
+                and self.request.query_params.get(CURSOR_PAGINATION_PARAM)
+                == CURSOR_PAGINATION_VALUE
+            ):
+                self._paginator = cursor_class()
+                return self._paginator
+        return super().paginator
@@ -0,0 +1,103 @@
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+
+def add_relation(model, user, target_field, target_id, fields):
+    """Создает связь пользователя с объектом (избранное, корзина,
+    подписка).
+
+    В PostgreSQL объект читается и связь вставляется одним запросом
+    INSERT ... ON CONFLICT DO NOTHING: повтор отсекает UniqueConstraint
+    модели, а не предварительная проверка. На других базах объект
+    читается отдельно, а повтор ловится по IntegrityError.
+
+    Возвращает объект с полями fields (None, если его нет) и признак
+    того, что связь создана. Сигнал post_save отправляется вручную,
+    чтобы обновились счетчики и ленты.
+    """
+
+    field = model._meta.get_field(target_field)
+    target_model = field.related_model
+    db = router.db_for_write(model)
+    connection = connections[db]
+
+    if connection.vendor != 'postgresql':
+        target = target_model.objects.using(db).only(*fields).filter(
+            pk=target_id
+        ).first()
+        if target is None:
+            return None, False
+        try:
+            with transaction.atomic(using=db):
+                model.objects.using(db).create(
+                    user=user, **{field.attname: target.pk}
+                )
+        except IntegrityError:
+            return target, False
+        return target, True
+
+    quote = connection.ops.quote_name
+    target_meta = target_model._meta
+    pk_column = quote(target_meta.pk.column)
+    columns = ', '.join([pk_column] + [
+        quote(target_meta.get_field(name).column) for name in fields
+        if not target_meta.get_field(name).primary_key
+    ])
+    sql = (
+        f'WITH target AS ('
+        f'SELECT {columns} '
+        f'FROM {quote(target_meta.db_table)} WHERE {pk_column} = %s'
+        f'), inserted AS ('
+        f'INSERT INTO {quote(model._meta.db_table)} '
+        f'({quote(model._meta.get_field("user").column)}, '
+        f'{quote(field.column)}) '
+        f'SELECT %s, {pk_column} FROM target '
+        f'ON CONFLICT DO NOTHING '
+        f'RETURNING {quote(model._meta.pk.column)}'
+        f') SELECT target.*, (SELECT * FROM inserted) AS relation_id '
+        f'FROM target'
+    )
+    rows = list(target_model.objects.db_manager(db).raw(
+        sql, [target_id, user.pk]
+    ))
+    if not rows:
+        return None, False
+    target = rows[0]
+    if target.relation_id is None:
+        return target, False
+    relation = model(
+        pk=target.relation_id, user=user, **{field.attname: target.pk}
+    )
+    post_save.send(
+        sender=model, instance=relation, created=True,
+        update_fields=None, raw=False, using=db
+    )
+    return target, True
+
+
+def delete_relation(model, user, target_field, target_id):
+    """Удаляет связь одним DELETE; возвращает, существовала ли она.
+
+    Сигнал post_delete отправляется вручную, чтобы обновились
+    счетчики и ленты.
+    """
+
+    field = model._meta.get_field(target_field)
+    db = router.db_for_write(model)
+    connection = connections[db]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} '
+            f'WHERE {quote(model._meta.get_field("user").column)} = %s '
+            f'AND {quote(field.column)} = %s',
+            [user.pk, target_id]
+        )
+        deleted = cursor.rowcount
+    if deleted:
+        post_delete.send(
+            sender=model,
+            instance=model(user=user, **{field.attname: target_id}),
+            using=db
+        )
+    return deleted > 0
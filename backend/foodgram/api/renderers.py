@@ -0,0 +1,61 @@
+import orjson
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# Типы, которых нет в orjson (Decimal, ленивые строки), и даты
+# кодируются как в JSONRenderer.
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+json_encoder = JSONEncoder()
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON через orjson с тем же выводом, что у JSONRenderer.
+
+    Ответ с отступом (indent в Accept) формирует JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(
+                data, accepted_media_type, renderer_context
+            )
+        content = orjson.dumps(
+            data, default=json_encoder.default, option=ORJSON_OPTIONS
+        )
+        # Как и JSONRenderer, экранируем разделители строк для JavaScript.
+        return content.replace(
+            '\u2028'.encode(), b'\\u2028'
+        ).replace('\u2029'.encode(), b'\\u2029')
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Базовый рендерер для выгрузки списка покупок.
+
+    Сам список отдается потоком из представления, рендерер нужен для
+    выбора формата через ?format= и для вывода ошибок.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return '\n'.join(
+                f'{key}: {value}' for key, value in data.items()
+            )
+        return str(data)
+
+
+class ShoppingListTxtRenderer(ShoppingListRenderer):
+    """Список покупок в текстовом формате."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    """Список покупок в формате CSV."""
+
+    media_type = 'text/csv'
+    format = 'csv'
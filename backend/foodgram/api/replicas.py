@@ -0,0 +1,127 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from .middleware import HybridMiddleware
+
+REPLICA_PIN_KEY = 'replica_pin:{digest}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# app_label модели записей DatabaseCache.
+CACHE_APP_LABEL = 'django_cache'
+
+# Реплика, из которой читает текущий запрос; None — основная база.
+current_replica = ContextVar('current_replica', default=None)
+
+
+@contextmanager
+def use_primary():
+    """Читать из основной базы внутри блока.
+
+    Нужен при заполнении кэшей, привязанных к поколению: отставшая
+    реплика сохранила бы под новым поколением устаревшие данные.
+    """
+
+    token = current_replica.set(None)
+    try:
+        yield
+    finally:
+        current_replica.reset(token)
+
+
+def replica_pin_key(request):
+    """Ключ закрепления клиента за основной базой.
+
+    Клиент определяется по заголовку Authorization, а без него — по
+    сессии или адресу: пользователь еще не аутентифицирован, когда
+    работает middleware. Поэтому после входа ключ меняется, и токен
+    всегда ищется в основной базе (см. CachedTokenAuthentication).
+    """
+
+    identity = (
+        request.headers.get('Authorization')
+        or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        or request.META.get('REMOTE_ADDR', '')
+    )
+    digest = hashlib.sha256(identity.encode()).hexdigest()
+    return REPLICA_PIN_KEY.format(digest=digest)
+
+
+class ReplicaRouter:
+    """Направляет чтение в реплику, выбранную для запроса.
+
+    Запись, миграции и чтение вне запросов (команды, фоновые задачи)
+    идут в основную базу. Туда же идет чтение DatabaseCache: кэш
+    на отставшей реплике вернул бы удаленные ключи и старые поколения.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == CACHE_APP_LABEL:
+            return DEFAULT_DB_ALIAS
+        return current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaMiddleware(HybridMiddleware):
+    """Читает безопасные запросы из реплик.
+
+    Одна реплика выбирается на весь запрос, чтобы его запросы видели
+    согласованные данные. После изменяющего запроса клиент на
+    REPLICA_PIN_SECONDS закрепляется за основной базой и видит свои
+    изменения, пока реплики догоняют. Под ASGI кэш читается через
+    sync_to_async: кэш в базе нельзя вызывать из цикла событий.
+    """
+
+    def choose_replica(self, request, pinned):
+        if request.method in SAFE_METHODS and not pinned:
+            return random.choice(settings.REPLICA_DATABASES)
+        return None
+
+    def handle(self, request):
+        if not settings.REPLICA_DATABASES:
+            return self.get_response(request)
+        key = replica_pin_key(request)
+        replica = self.choose_replica(
+            request, request.method in SAFE_METHODS and cache.get(key)
+        )
+        token = current_replica.set(replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        if request.method not in SAFE_METHODS:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def ahandle(self, request):
+        if not settings.REPLICA_DATABASES:
+            return await self.get_response(request)
+        key = replica_pin_key(request)
+        replica = self.choose_replica(
+            request,
+            request.method in SAFE_METHODS
+            and await sync_to_async(cache.get)(key)
+        )
+        token = current_replica.set(replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+        if request.method not in SAFE_METHODS:
+            await sync_to_async(cache.set)(
+                key, True, settings.REPLICA_PIN_SECONDS
+            )
+        return response
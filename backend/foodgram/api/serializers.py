@@ -1,11 +1,44 @@
+from collections import defaultdict
+from operator import itemgetter
+
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
-from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.db.models.signals import post_save
 from drf_extra_fields.fields import Base64ImageField
-from recipes.models import (Ingredient, Tag, TagInRecipe, Follow,
-                            IngredientInRecipe, Recipe, Favorite, ShoppingCart)
+from recipes.models import (Ingredient, Tag, Follow,
+                            IngredientInRecipe, Recipe, Favorite, ShoppingCart,
+                            TagInRecipe)
 
+from recipes.images import thumbnail_sizes
 from users.models import User
+from .authentication import make_signed_token, signed_tokens_enabled
+from .fieldsets import SparseFieldsetMixin, get_response_fields
+
+
+def get_thumbnail_urls(instance, field):
+    """Ссылки на миниатюры изображения по размерам.
+
+    Пока фоновая обработка не завершена, отдается ссылка на оригинал.
+    """
+
+    return thumbnail_urls(
+        type(instance), field, getattr(instance, field).name,
+        getattr(instance, f'{field}_thumbnails')
+    )
+
+
+def thumbnail_urls(model, field, name, thumbnails):
+    """То же по имени файла и словарю миниатюр, без экземпляра модели."""
+
+    if not name:
+        return None
+    storage = model._meta.get_field(field).storage
+    return {
+        size: storage.url(thumbnails.get(size, name))
+        for size in thumbnail_sizes(model, field)
+    }
 
 
 class IngredientSerializer(ModelSerializer):
@@ -37,17 +70,19 @@ class TagSerializer(ModelSerializer):
         fields = ('id', 'name', 'slug')
 
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class UserProfileSerializer(SparseFieldsetMixin,
+                            serializers.ModelSerializer):
     """Сериализатор для модели User."""
 
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
+    avatar_thumbnails = serializers.SerializerMethodField()
 
     class Meta:
 
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
-                  'is_subscribed', 'avatar')
+                  'is_subscribed', 'avatar', 'avatar_thumbnails')
 
     def get_is_subscribed(self, obj):
         """Метод проверки подписки"""
@@ -55,11 +90,17 @@ class UserProfileSerializer(serializers.ModelSerializer):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        is_subscribed = getattr(obj, 'is_subscribed', None)
+        if is_subscribed is not None:
+            return is_subscribed
         return Follow.objects.filter(user=user, author=obj.id).exists()
 
     def get_avatar(self, obj):
         return obj.avatar.url if obj.avatar else None
 
+    def get_avatar_thumbnails(self, obj):
+        return get_thumbnail_urls(obj, 'avatar')
+
     def get_subscribe(self, obj):
         """Метод для валидации подписки/отписки"""
         request = self.context.get('request')
@@ -91,6 +132,17 @@ class UserProfileSerializer(serializers.ModelSerializer):
         return None
 
 
+class AuthTokenSerializer(serializers.Serializer):
+    """Токен, выдаваемый при входе: обычный или подписанный."""
+
+    auth_token = serializers.SerializerMethodField()
+
+    def get_auth_token(self, token):
+        if signed_tokens_enabled():
+            return make_signed_token(token.user)
+        return token.key
+
+
 class AvatarSerializer(serializers.ModelSerializer):
     """Сериализатор аватара."""
 
@@ -147,45 +199,12 @@ class FollowSerializer(UserProfileSerializer):
                                                       'recipes_count')
         read_only_fields = ('email', 'username', 'first_name', 'last_name')
 
-    def validate(self, data):
-        """
-        Валидация для подписки/отписки
-        """
-        request = self.context.get('request')
-        author = self.instance
-
-        if not request or not request.user.is_authenticated:
-            raise ValidationError("Требуется авторизация")
-
-        if request.method == 'POST':
-            self._validate_subscription(author, request.user)
-        elif request.method == 'DELETE':
-            self._validate_unsubscription(author, request.user)
-
-        return data
-
-    def _validate_subscription(self, author, user):
-        if user == author:
-            raise ValidationError(
-                {"error": "Нельзя подписаться на самого себя"}
-            )
-        if Follow.objects.filter(user=user, author=author).exists():
-            raise ValidationError(
-                {"error": "Вы уже подписаны на этого пользователя"}
-            )
-
-    def _validate_unsubscription(self, author, user):
-        if not Follow.objects.filter(user=user, author=author).exists():
-            raise ValidationError(
-                {"error": "Вы не подписаны на этого пользователя"}
-            )
-
     def get_recipes(self, obj):
         """Метод для получения рецептов"""
         request = self.context.get('request')
         recipes = obj.recipes.all()
         recipes_limit = request.query_params.get('recipes_limit')
-        if recipes_limit:
+        if recipes_limit and recipes_limit.isdigit():
             recipes = recipes[:int(recipes_limit)]
         return AdditionalForRecipeSerializer(recipes, many=True).data
 
@@ -193,7 +212,7 @@ class FollowSerializer(UserProfileSerializer):
     def get_recipes_count(obj):
         """Метод для получения количества рецептов"""
 
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
@@ -210,7 +229,7 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Сериализатор для рецептов."""
 
     tags = TagSerializer(many=True)
@@ -219,21 +238,37 @@ class RecipeSerializer(serializers.ModelSerializer):
         source='ingredient_list', many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
 
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time'
+                  'image', 'thumbnails', 'text', 'cooking_time'
                   )
 
+    def get_thumbnails(self, obj):
+        """Ссылки на миниатюры для карточки и страницы рецепта."""
+
+        thumbnails = get_thumbnail_urls(obj, 'image')
+        request = self.context.get('request')
+        if thumbnails is None or request is None:
+            return thumbnails
+        return {
+            name: request.build_absolute_uri(url)
+            for name, url in thumbnails.items()
+        }
+
     def get_is_favorited(self, obj):
         """Метод проверки на добавление в избранное."""
 
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        is_favorited = getattr(obj, 'is_favorited', None)
+        if is_favorited is not None:
+            return is_favorited
         return Favorite.objects.filter(
             user=request.user, recipe=obj
         ).exists()
@@ -244,29 +279,127 @@ class RecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None or request.user.is_anonymous:
             return False
+        is_in_shopping_cart = getattr(obj, 'is_in_shopping_cart', None)
+        if is_in_shopping_cart is not None:
+            return is_in_shopping_cart
         return ShoppingCart.objects.filter(
             user=request.user, recipe=obj
         ).exists()
 
-    def validate_recipe_in_favorite(self, recipe, user):
-        if Favorite.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                f'Рецепт "{recipe.name}" уже в избранном.')
 
-    def validate_recipe_not_in_favorite(self, recipe, user):
-        if not Favorite.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                f'Рецепта "{recipe.name}" нет в избранном.')
+class RecipeRowListSerializer(serializers.ListSerializer):
+    """Список рецептов из строк values() без экземпляров моделей.
 
-    def validate_recipe_in_cart(self, recipe, user):
-        if ShoppingCart.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                f'Рецепт "{recipe.name}" уже в корзине.')
+    Теги и ингредиенты страницы читаются двумя запросами values_list
+    и раскладываются по словарям. Вывод совпадает с RecipeSerializer,
+    включая отбор полей по ?fields= и ?omit=.
+    """
 
-    def validate_recipe_not_in_cart(self, recipe, user):
-        if not ShoppingCart.objects.filter(user=user, recipe=recipe).exists():
-            raise serializers.ValidationError(
-                f'Рецепта "{recipe.name}" нет в корзине.')
+    def to_representation(self, data):
+        rows = list(data)
+        request = self.context.get('request')
+        fields = RecipeSerializer.Meta.fields
+        if request is None:
+            def absolute(url):
+                return url
+        else:
+            fields = get_response_fields(request, fields)
+            absolute = request.build_absolute_uri
+        authenticated = request is not None and request.user.is_authenticated
+        recipe_ids = [row['id'] for row in rows]
+        tags = defaultdict(list)
+        if recipe_ids and 'tags' in fields:
+            tag_data = {}
+            for recipe_id, tag_id, name, slug in TagInRecipe.objects.filter(
+                recipe__in=recipe_ids
+            ).order_by('tag__name').values_list(
+                'recipe_id', 'tag_id', 'tag__name', 'tag__slug'
+            ):
+                tag = tag_data.get(tag_id)
+                if tag is None:
+                    tag = tag_data[tag_id] = {
+                        'id': tag_id, 'name': name, 'slug': slug
+                    }
+                tags[recipe_id].append(tag)
+        ingredients = defaultdict(list)
+        if recipe_ids and 'ingredients' in fields:
+            for recipe_id, *ingredient in IngredientInRecipe.objects.filter(
+                recipe__in=recipe_ids
+            ).values_list(
+                'recipe_id', 'ingredient_id', 'ingredient__name',
+                'ingredient__measurement_unit', 'amount'
+            ):
+                ingredients[recipe_id].append(dict(zip(
+                    ('id', 'name', 'measurement_unit', 'amount'), ingredient
+                )))
+        image_storage = Recipe._meta.get_field('image').storage
+        avatar_storage = User._meta.get_field('avatar').storage
+
+        def author(row):
+            avatar = row['author__avatar']
+            return {
+                'email': row['author__email'],
+                'id': row['author'],
+                'username': row['author__username'],
+                'first_name': row['author__first_name'],
+                'last_name': row['author__last_name'],
+                'is_subscribed': authenticated and row['is_subscribed'],
+                'avatar': avatar_storage.url(avatar) if avatar else None,
+                'avatar_thumbnails': thumbnail_urls(
+                    User, 'avatar', avatar, row['author__avatar_thumbnails']
+                ),
+            }
+
+        def image(row):
+            name = row['image']
+            return absolute(image_storage.url(name)) if name else None
+
+        def thumbnails(row):
+            urls = thumbnail_urls(
+                Recipe, 'image', row['image'], row['image_thumbnails']
+            )
+            return urls and {
+                size: absolute(url) for size, url in urls.items()
+            }
+
+        builders = {
+            'id': itemgetter('id'),
+            'tags': lambda row: tags[row['id']],
+            'author': author,
+            'ingredients': lambda row: ingredients[row['id']],
+            'is_favorited': lambda row: (
+                authenticated and row['is_favorited']
+            ),
+            'is_in_shopping_cart': lambda row: (
+                authenticated and row['is_in_shopping_cart']
+            ),
+            'name': itemgetter('name'),
+            'image': image,
+            'thumbnails': thumbnails,
+            'text': itemgetter('text'),
+            'cooking_time': itemgetter('cooking_time'),
+        }
+        selected = [(name, builders[name]) for name in fields]
+        return [
+            {name: build(row) for name, build in selected} for row in rows
+        ]
+
+
+class RecipeRowSerializer(serializers.BaseSerializer):
+    """Рецепт из строки values() для списков рецептов.
+
+    Строки готовит RecipeViewSet.get_row_queryset, страница целиком
+    обрабатывается в RecipeRowListSerializer.
+    """
+
+    class Meta:
+        fields = RecipeSerializer.Meta.fields
+        list_serializer_class = RecipeRowListSerializer
+
+    def to_representation(self, instance):
+        return RecipeRowListSerializer(
+            child=RecipeRowSerializer(), context=self.context
+        ).to_representation([instance])[0]
 
 
 class CreateIngredientsInRecipeSerializer(serializers.ModelSerializer):
@@ -307,7 +440,23 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
                   'image', 'text', 'cooking_time')
 
     def to_representation(self, instance):
+        """Ответ в формате RecipeSerializer.
+
+        Связи загружаются заново двумя запросами: кэш связей экземпляра
+        мог устареть после записи ингредиентов и тегов.
+        """
 
+        instance._prefetched_objects_cache = {}
+        prefetch_related_objects(
+            [instance],
+            Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            ),
+            'tags'
+        )
         serializer = RecipeSerializer(
             instance,
             context={
@@ -319,34 +468,79 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     def validate(self, data):
         """Метод валидации ингредиентов"""
 
-        ingredients = self.initial_data.get('ingredients')
-        lst_ingredient = []
-
-        for ingredient in ingredients:
-            if ingredient['id'] in lst_ingredient:
-                raise serializers.ValidationError(
-                    'Ингредиенты должны быть уникальными!'
-                )
-            lst_ingredient.append(ingredient['id'])
+        ingredients = data.get('ingredients')
+        if ingredients is None:
+            return data
+        ids = [ingredient['id'] for ingredient in ingredients]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты должны быть уникальными!'
+            )
+        existing = Ingredient.objects.only('id').in_bulk(ids)
+        missing = [id for id in ids if id not in existing]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты с id {missing} не существуют!'
+            )
 
         return data
 
     def create_ingredients(self, ingredients, recipe):
-        """Метод создания ингредиента"""
+        """Метод создания ингредиентов одним запросом"""
 
-        for element in ingredients:
-            id = element['id']
-            ingredient = Ingredient.objects.get(pk=id)
-            amount = element['amount']
-            IngredientInRecipe.objects.create(
-                ingredient=ingredient, recipe=recipe, amount=amount
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient_id=element['id'],
+                amount=element['amount']
             )
+            for element in ingredients
+        )
+
+    def update_ingredients(self, ingredients, recipe):
+        """Метод синхронизации ингредиентов рецепта.
+
+        Добавляются, изменяются и удаляются только отличающиеся строки.
+        bulk_update и bulk_create не отправляют сигналы, поэтому
+        post_save отправляется вручную, чтобы сбросить кэш корзин.
+        """
+
+        existing = {
+            row.ingredient_id: row for row in recipe.ingredient_list.all()
+        }
+        to_create = []
+        to_update = []
+        for element in ingredients:
+            row = existing.pop(element['id'], None)
+            if row is None:
+                to_create.append(IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient_id=element['id'],
+                    amount=element['amount']
+                ))
+            elif row.amount != element['amount']:
+                row.amount = element['amount']
+                to_update.append(row)
+        if existing:
+            IngredientInRecipe.objects.filter(
+                pk__in=[row.pk for row in existing.values()]
+            ).delete()
+        IngredientInRecipe.objects.bulk_update(to_update, ('amount',))
+        IngredientInRecipe.objects.bulk_create(to_create)
+        db = router.db_for_write(IngredientInRecipe)
+        for rows, created in ((to_update, False), (to_create, True)):
+            for row in rows:
+                post_save.send(
+                    sender=IngredientInRecipe, instance=row, created=created,
+                    update_fields=None, raw=False, using=db
+                )
 
     def create_tags(self, tags, recipe):
         """Метод добавления тега"""
 
         recipe.tags.set(tags)
 
+    @transaction.atomic
     def create(self, validated_data):
         """Метод создания модели"""
 
@@ -359,15 +553,16 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         self.create_tags(tags, recipe)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Метод обновления модели"""
 
-        IngredientInRecipe.objects.filter(recipe=instance).delete()
-        TagInRecipe.objects.filter(recipe=instance).delete()
-
-        self.create_ingredients(validated_data.pop('ingredients'), instance)
-        self.create_tags(validated_data.pop('tags'), instance)
-
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            self.update_ingredients(ingredients, instance)
+        if tags is not None:
+            self.create_tags(tags, instance)
         return super().update(instance, validated_data)
 
 
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from recipes.models import Recipe
+from .replicas import use_primary
+
+SHORT_LINK_KEY = 'short_link:{}'
+
+
+class ShortLinkResolver:
+    """Соответствие короткого кода рецепта его pk.
+
+    Первый уровень - LRU в памяти процесса, второй - общий кэш,
+    последний - запрос к базе только за pk. Сигналы обновляют оба
+    уровня при сохранении и удалении рецепта; в других процессах
+    запись удаленного рецепта остается в LRU до вытеснения.
+
+    Первый вызов resolve() в процессе одним запросом загружает в LRU
+    коды prewarm последних рецептов. Общий кэш при этом не трогается,
+    чтобы не вытеснить из него другие записи.
+    """
+
+    def __init__(self, maxsize, prewarm=0):
+        self._lock = threading.Lock()
+        self._maxsize = maxsize
+        self._prewarm = min(prewarm, maxsize)
+        self._local = OrderedDict()
+
+    def _remember(self, short_code, pk):
+        with self._lock:
+            self._local[short_code] = pk
+            self._local.move_to_end(short_code)
+            while len(self._local) > self._maxsize:
+                self._local.popitem(last=False)
+
+    def resolve(self, short_code):
+        """Возвращает pk рецепта или None, если код не найден."""
+
+        if self._prewarm:
+            self.prewarm()
+        with self._lock:
+            pk = self._local.get(short_code)
+            if pk is not None:
+                self._local.move_to_end(short_code)
+                return pk
+        pk = cache.get(SHORT_LINK_KEY.format(short_code))
+        if pk is None:
+            with use_primary():
+                pk = next(iter(Recipe.objects.filter(
+                    short_code=short_code
+                ).order_by().values_list('pk', flat=True)[:1]), None)
+            if pk is None:
+                return None
+            cache.set(SHORT_LINK_KEY.format(short_code), pk, None)
+        self._remember(short_code, pk)
+        return pk
+
+    def set(self, short_code, pk):
+        cache.set(SHORT_LINK_KEY.format(short_code), pk, None)
+        self._remember(short_code, pk)
+
+    def discard(self, short_code):
+        cache.delete(SHORT_LINK_KEY.format(short_code))
+        with self._lock:
+            self._local.pop(short_code, None)
+
+    def prewarm(self):
+        """Загружает в LRU коды последних рецептов один раз за процесс."""
+
+        with self._lock:
+            limit, self._prewarm = self._prewarm, 0
+        if not limit:
+            return
+        links = list(
+            Recipe.objects.values_list('short_code', 'pk')[:limit]
+        )
+        for short_code, pk in reversed(links):
+            self._remember(short_code, pk)
+
+
+short_links = ShortLinkResolver(
+    settings.SHORT_LINK_CACHE_SIZE, settings.SHORT_LINK_PREWARM
+)
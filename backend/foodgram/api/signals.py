@@ -0,0 +1,177 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (m2m_changed, post_delete, post_init,
+                                      post_save)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, Tag)
+from .authentication import invalidate_token, revoke_user_tokens
+from .autocomplete import ingredient_index
+from .cache import (bump_response_generation, invalidate_ingredient_carts,
+                    invalidate_recipe_carts, invalidate_shopping_cart,
+                    tag_slugs)
+from .metrics import install_query_timer
+from .shortlinks import short_links
+
+User = get_user_model()
+
+# Поля, изменение которых отзывает токены пользователя.
+AUTH_FIELDS = ('is_active', 'is_staff', 'is_superuser')
+
+RESPONSE_CACHE_DEPENDENCIES = {
+    Tag: ('tags', 'recipes'),
+    Ingredient: ('ingredients', 'recipes'),
+    Recipe: ('recipes',),
+    IngredientInRecipe: ('recipes',),
+}
+
+
+connection_created.connect(install_query_timer)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    """Сбрасывает префиксный индекс после фиксации изменения.
+
+    До фиксации другой процесс перестроил бы индекс по старым данным
+    и не заметил бы изменения до следующей смены версии.
+    """
+
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_slugs(sender, **kwargs):
+    """Сбрасывает соответствие слагов тегов после фиксации изменения;
+    остальные процессы заметят новое поколение 'tags'."""
+
+    transaction.on_commit(tag_slugs.invalidate)
+
+
+def invalidate_response_cache(sender, **kwargs):
+    """Сбрасывает кэш ответов, зависящих от измененной модели."""
+
+    bump_response_generation(*RESPONSE_CACHE_DEPENDENCIES[sender])
+
+
+for model in RESPONSE_CACHE_DEPENDENCIES:
+    post_save.connect(invalidate_response_cache, sender=model)
+    post_delete.connect(invalidate_response_cache, sender=model)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def invalidate_cart(sender, instance, **kwargs):
+    """Сбрасывает кэш списка покупок владельца корзины."""
+
+    transaction.on_commit(lambda: invalidate_shopping_cart(instance.user_id))
+
+
+@receiver((post_save, post_delete), sender=IngredientInRecipe)
+def invalidate_recipe_ingredient_carts(sender, instance, **kwargs):
+    """Сбрасывает кэш корзин с рецептом, ингредиенты которого
+    изменились.
+
+    Держатели корзин выбираются после фиксации: при удалении рецепта
+    его строки корзин к этому моменту уже удалены и сбрасываются
+    собственным сигналом.
+    """
+
+    transaction.on_commit(lambda: invalidate_recipe_carts(instance.recipe_id))
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_ingredient_carts_on_save(sender, instance, **kwargs):
+    """Сбрасывает кэш корзин с рецептами, где есть ингредиент:
+    в списке покупок выводятся его название и единица измерения.
+
+    Удаление ингредиента удаляет его строки в рецептах, и кэш
+    сбрасывает их сигнал post_delete.
+    """
+
+    transaction.on_commit(lambda: invalidate_ingredient_carts(instance.pk))
+
+
+@receiver(post_save, sender=Recipe)
+def update_short_link(sender, instance, **kwargs):
+    """Обновляет соответствие короткого кода рецепту."""
+
+    short_links.set(instance.short_code, instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def discard_short_link(sender, instance, **kwargs):
+    """Удаляет короткий код удаленного рецепта из кэша."""
+
+    short_links.discard(instance.short_code)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, action, **kwargs):
+    """Сбрасывает кэш рецептов при изменении их тегов."""
+
+    if action.startswith('post_'):
+        bump_response_generation('recipes')
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, update_fields=None, **kwargs):
+    """Сбрасывает кэш рецептов при изменении профиля автора."""
+
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    if instance.recipes_count:
+        bump_response_generation('recipes')
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_auth_token(sender, instance, **kwargs):
+    """Сбрасывает кэш токена и отзывает подписанные токены при выходе."""
+
+    invalidate_token(instance.key)
+    revoke_user_tokens(instance.user_id)
+
+
+def auth_state(instance):
+    """Права пользователя без обращения к отложенным полям."""
+
+    return tuple(instance.__dict__.get(name) for name in AUTH_FIELDS)
+
+
+@receiver(post_init, sender=User)
+def remember_auth_state(sender, instance, **kwargs):
+    instance._saved_auth_state = auth_state(instance)
+
+
+@receiver(post_save, sender=User)
+def invalidate_auth_user(sender, instance, created, update_fields=None,
+                         **kwargs):
+    """Сбрасывает кэш аутентификации при изменении пользователя.
+
+    Смена пароля, прав и деактивация также отзывают все токены
+    пользователя: поколение в базе увеличивается, и кэшированные
+    снимки и подписанные токены перестают приниматься.
+    """
+
+    if created:
+        return
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    for key in Token.objects.filter(
+        user=instance.pk
+    ).values_list('key', flat=True):
+        invalidate_token(key)
+    state = auth_state(instance)
+    # None — поле было отложено при загрузке, и сравнивать не с чем.
+    rights_changed = any(
+        saved is not None and saved != current
+        for saved, current in zip(instance._saved_auth_state, state)
+    )
+    # set_password() сохраняет новый пароль в _password до конца save().
+    if instance._password is not None or rights_changed:
+        revoke_user_tokens(instance.pk)
+        # Иначе повторный save() экземпляра вернул бы старое поколение.
+        instance.refresh_from_db(fields=('token_generation',))
+    instance._saved_auth_state = state
@@ -0,0 +1,1300 @@
+import base64
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlencode
+
+from django.conf import settings
+from asgiref.sync import SyncToAsync, async_to_sync
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.files.base import ContentFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection, connections, router
+from django.test import (AsyncClient, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone as django_timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import local_tokens, token_cache_key
+from api.autocomplete import ingredient_index
+from api.cache import (get_response_generation, shopping_cart_key,
+                       tag_slugs)
+from api.management.commands.data_loader import Command
+from api.replicas import current_replica
+from api.shortlinks import ShortLinkResolver
+from recipes import images
+from recipes.images import claim_jobs, process_job
+from recipes.models import (Favorite, Follow, ImageJob, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart, Tag,
+                            TagInRecipe, TimelineEntry)
+from users.models import User
+
+RECIPES_PER_AUTHOR = 25
+AUTHORS = 5
+PUB_DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def image_data():
+    buffer = io.BytesIO()
+    Image.new('RGB', (1, 1)).save(buffer, 'PNG')
+    return 'data:image/png;base64,' + base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+def create_user(name):
+    return User.objects.create_user(
+        email=f'{name}@example.com', username=name, password='password',
+        first_name=name, last_name=name
+    )
+
+
+class RecipeQueryPlanTest(TestCase):
+    """Число запросов списка и карточки рецепта не зависит от размера
+    страницы, числа авторов, тегов и ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = [create_user(f'author{number}') for number in range(AUTHORS)]
+        cls.reader = create_user('reader')
+        Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(3)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(30)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {number}',
+                   image='recipes/image.png', cooking_time=number + 1)
+            for author in authors
+            for number in range(RECIPES_PER_AUTHOR)
+        )
+        tags = list(Tag.objects.all())
+        ingredients = list(Ingredient.objects.all())
+        recipes = list(Recipe.objects.order_by('id'))
+        # У первого рецепта один тег и один ингредиент, у тридцатого —
+        # все теги и все ингредиенты.
+        TagInRecipe.objects.bulk_create(
+            TagInRecipe(recipe=recipe, tag=tag)
+            for number, recipe in enumerate(recipes)
+            for tag in tags[:number % len(tags) + 1]
+        )
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+            for number, recipe in enumerate(recipes)
+            for ingredient in ingredients[:number % len(ingredients) + 1]
+        )
+        cls.small_recipe = recipes[0]
+        cls.large_recipe = recipes[len(ingredients) - 1]
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def count_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def assert_list_queries_constant(self):
+        for client in (self.anonymous, self.client):
+            with self.subTest(authenticated=client is self.client):
+                self.assertEqual(
+                    self.count_queries(client, '/api/recipes/?limit=6'),
+                    self.count_queries(client, '/api/recipes/?limit=100')
+                )
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        self.assert_list_queries_constant()
+
+    @override_settings(FAST_RECIPE_LIST=False)
+    def test_serializer_list_queries_do_not_depend_on_page_size(self):
+        self.assert_list_queries_constant()
+
+    def test_retrieve_queries_do_not_depend_on_relations(self):
+        for client in (self.anonymous, self.client):
+            with self.subTest(authenticated=client is self.client):
+                self.assertEqual(
+                    self.count_queries(
+                        client, f'/api/recipes/{self.small_recipe.id}/'
+                    ),
+                    self.count_queries(
+                        client, f'/api/recipes/{self.large_recipe.id}/'
+                    )
+                )
+
+
+class RecipeRowSerializerTest(TestCase):
+    """RecipeRowListSerializer отдает то же, что RecipeSerializer,
+    для анонимного и вошедшего пользователя и при отборе полей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        author = create_user('author')
+        author.avatar = 'users/avatar.png'
+        author.avatar_thumbnails = {'small': 'thumbnails/avatar.webp'}
+        author.save()
+        other = create_user('other')
+        tags = [
+            Tag.objects.create(name=name, slug=slug)
+            for name, slug in (('Ужин', 'dinner'), ('Завтрак', 'breakfast'))
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Сахар', 'Яйца')
+        ]
+        recipes = [
+            Recipe.objects.create(
+                author=recipe_author, name=f'Рецепт {number}',
+                text='Описание', image='recipes/image.png',
+                cooking_time=number + 1,
+                image_thumbnails=(
+                    {'card': 'thumbnails/card.webp'} if number else {}
+                )
+            )
+            for number, recipe_author in enumerate((author, other, author))
+        ]
+        for number, recipe in enumerate(recipes):
+            for tag in tags[:number + 1]:
+                TagInRecipe.objects.create(recipe=recipe, tag=tag)
+            for amount, ingredient in enumerate(ingredients[number:], 1):
+                IngredientInRecipe.objects.create(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+        Follow.objects.create(user=cls.reader, author=author)
+        Favorite.objects.create(user=cls.reader, recipe=recipes[0])
+        ShoppingCart.objects.create(user=cls.reader, recipe=recipes[1])
+
+    def setUp(self):
+        cache.clear()
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def get(self, client, url, fast):
+        with override_settings(FAST_RECIPE_LIST=fast):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['results'])
+        return response.json()
+
+    def test_row_serializer_matches_model_serializer(self):
+        queries = (
+            '',
+            '?fields=id,name,tags',
+            '?fields=author,is_favorited,is_in_shopping_cart,thumbnails',
+            '?omit=ingredients,author',
+            '?fields=id,ingredients,image&omit=image',
+        )
+        cases = [
+            (client, f'/api/recipes/{query}')
+            for client in (self.anonymous, self.client)
+            for query in queries
+        ] + [
+            (self.client, f'/api/recipes/feed/{query}') for query in queries
+        ]
+        for client, url in cases:
+            with self.subTest(url=url, authenticated=client is self.client):
+                self.assertEqual(
+                    self.get(client, url, fast=True),
+                    self.get(client, url, fast=False)
+                )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class RecipeWriteQueryTest(TestCase):
+    """Создание и изменение рецепта выполняют одинаковое число запросов
+    при любом количестве ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(31)
+        )
+        cls.ingredients = list(Ingredient.objects.values_list('id', flat=True))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def recipe_data(self, ingredients):
+        return {
+            'ingredients': [
+                {'id': ingredient, 'amount': 1} for ingredient in ingredients
+            ],
+            'tags': [self.tag.id],
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'image': image_data(),
+        }
+
+    def count_queries(self, method, url, data, status):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(response.status_code, status, response.content)
+        self.assertEqual(
+            len(response.json()['ingredients']), len(data['ingredients'])
+        )
+        return len(context), response.json()['id']
+
+    def test_create_and_update_queries_do_not_depend_on_ingredients(self):
+        queries = {}
+        # Изменение удаляет первый ингредиент и добавляет следующий.
+        for size in (1, len(self.ingredients) - 1):
+            data = self.recipe_data(self.ingredients[:size])
+            created, recipe_id = self.count_queries(
+                'post', '/api/recipes/', data, 201
+            )
+            data = self.recipe_data(self.ingredients[1:size + 1])
+            updated, _ = self.count_queries(
+                'patch', f'/api/recipes/{recipe_id}/', data, 200
+            )
+            queries[size] = (created, updated)
+        self.assertEqual(queries[1], queries[len(self.ingredients) - 1])
+
+
+@override_settings(INGREDIENT_AUTOCOMPLETE_LIMIT=4)
+class IngredientSearchTest(TestCase):
+    """Индекс в памяти и поиск в базе отдают одинаковые результаты,
+    а индекс не обращается к кэшу на каждый запрос."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г') for name in (
+                'Сыроежки', 'Сыр твердый', 'Сырники', 'Сыр', 'Сырцы',
+                'Сырок', 'Творог',
+            )
+        )
+
+    def setUp(self):
+        ingredient_index.invalidate()
+        self.client = APIClient()
+
+    def search(self, name):
+        response = self.client.get('/api/ingredients/', {'name': name})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_index_and_database_return_the_same_page(self):
+        expected = ['Сыр', 'Сырок', 'Сырцы', 'Сырники']
+        indexed = self.search('Сыр ')
+        with override_settings(INGREDIENT_INDEX_TTL=0):
+            self.assertEqual(self.search('Сыр '), indexed)
+        self.assertEqual(
+            [ingredient['name'] for ingredient in indexed], expected
+        )
+        self.assertEqual(
+            [ingredient['name'] for ingredient in self.search('Сыр т')],
+            ['Сыр твердый']
+        )
+
+    def test_index_reads_nothing_until_ttl_expires(self):
+        self.search('Сыр')
+        # Запись мимо сигналов: индекс узнает о ней только по TTL.
+        Ingredient.objects.bulk_create(
+            [Ingredient(name='Сырная паста', measurement_unit='г')]
+        )
+        with mock.patch.object(cache, 'get_or_set') as cache_get, \
+                CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.search('Сырная'), [])
+        cache_get.assert_not_called()
+        self.assertEqual(len(context), 0)
+        expired = time.monotonic() + settings.INGREDIENT_INDEX_TTL + 1
+        with mock.patch('api.autocomplete.time.monotonic',
+                        return_value=expired):
+            self.assertEqual(len(self.search('Сырная')), 1)
+
+    def test_change_is_visible_after_commit(self):
+        self.search('Сыр')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='Сырная паста',
+                                      measurement_unit='г')
+        self.assertEqual(len(self.search('Сырная')), 1)
+
+
+class TagSlugMapTest(TestCase):
+    """Фильтр по тегам берет id из памяти процесса и замечает новые
+    теги после фиксации или по истечении TTL."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Рецепт', image='recipes/image.png'
+        )
+        TagInRecipe.objects.create(
+            recipe=cls.recipe,
+            tag=Tag.objects.create(name='Завтрак', slug='breakfast')
+        )
+
+    def setUp(self):
+        tag_slugs.invalidate()
+        self.client = APIClient()
+
+    def filter(self, *slugs):
+        return self.client.get('/api/recipes/', {'tags': slugs})
+
+    def add_tag(self, slug):
+        tag = Tag.objects.create(name=slug, slug=slug)
+        TagInRecipe.objects.create(recipe=self.recipe, tag=tag)
+
+    def test_warm_map_reads_no_tags(self):
+        self.assertEqual(self.filter('breakfast').json()['count'], 1)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.filter('breakfast').json()['count'], 1)
+        self.assertFalse(any(
+            'FROM "recipes_tag"' in query['sql']
+            and 'recipes_taginrecipe' not in query['sql']
+            for query in context.captured_queries
+        ))
+
+    def test_new_tag_is_visible_after_commit(self):
+        self.filter('breakfast')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_tag('dinner')
+        self.assertEqual(self.filter('dinner').json()['count'], 1)
+
+    def test_map_is_rebuilt_after_ttl(self):
+        self.filter('breakfast')
+        # Запись мимо сигналов: соответствие узнает о ней только по TTL.
+        Tag.objects.bulk_create([Tag(name='dinner', slug='dinner')])
+        self.assertEqual(self.filter('dinner').status_code, 400)
+        expired = time.monotonic() + settings.TAG_SLUGS_TTL + 1
+        with mock.patch('api.cache.time.monotonic', return_value=expired):
+            self.assertEqual(self.filter('dinner').status_code, 200)
+
+
+class CounterTest(TestCase):
+    """Счетчики избранного, корзины, рецептов и подписчиков меняются
+    при добавлении и удалении, а recount исправляет расхождения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='recipes/image.png'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def counters(self):
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        return {
+            'favorites_count': self.recipe.favorites_count,
+            'carts_count': self.recipe.carts_count,
+            'recipes_count': self.author.recipes_count,
+            'followers_count': self.author.followers_count,
+        }
+
+    def test_relations_move_counters(self):
+        recipe = f'/api/recipes/{self.recipe.id}/'
+        subscribe = f'/api/users/{self.author.id}/subscribe/'
+        for url, counter in (
+            (f'{recipe}favorite/', 'favorites_count'),
+            (f'{recipe}shopping_cart/', 'carts_count'),
+            (subscribe, 'followers_count'),
+        ):
+            with self.subTest(counter=counter):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                self.assertEqual(self.counters()[counter], 1)
+                # Повтор отклоняется и не меняет счетчик.
+                self.assertEqual(self.client.post(url).status_code, 400)
+                self.assertEqual(self.counters()[counter], 1)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+                self.assertEqual(self.counters()[counter], 0)
+                self.assertEqual(self.client.delete(url).status_code, 400)
+                self.assertEqual(self.counters()[counter], 0)
+
+    def test_recipes_move_author_counter(self):
+        self.assertEqual(self.counters()['recipes_count'], 1)
+        recipe = Recipe.objects.create(
+            author=self.author, name='Второй', image='recipes/image.png'
+        )
+        self.assertEqual(self.counters()['recipes_count'], 2)
+        recipe.delete()
+        self.assertEqual(self.counters()['recipes_count'], 1)
+
+    def test_recount_repairs_drift(self):
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=self.recipe)
+        Follow.objects.create(user=self.reader, author=self.author)
+        expected = {
+            'favorites_count': 1,
+            'carts_count': 1,
+            'recipes_count': 1,
+            'followers_count': 1,
+        }
+        self.assertEqual(self.counters(), expected)
+        Recipe.objects.update(favorites_count=5, carts_count=0)
+        User.objects.update(recipes_count=0, followers_count=7)
+        call_command('recount', stdout=io.StringIO())
+        self.assertEqual(self.counters(), expected)
+        User.objects.filter(pk=self.reader.pk).update(followers_count=3)
+        call_command('recount', stdout=io.StringIO())
+        self.reader.refresh_from_db()
+        self.assertEqual(
+            (self.reader.recipes_count, self.reader.followers_count), (0, 0)
+        )
+
+
+class ResponseGenerationTest(TestCase):
+    """Поколение кэша ответов меняется только после фиксации записи."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_generation_changes_after_commit(self):
+        generation = get_response_generation('tags')
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Тег', slug='tag')
+            self.assertEqual(get_response_generation('tags'), generation)
+        self.assertEqual(get_response_generation('tags'), generation + 1)
+
+
+class RecipeCursorPaginationTest(TestCase):
+    """Курсор рецептов идет по (pub_date, id) без OFFSET, даже если
+    у всех рецептов одна дата публикации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {number}',
+                   image='recipes/image.png', pub_date=PUB_DATE)
+            for number in range(20)
+        )
+        cls.ids = list(
+            Recipe.objects.order_by('-id').values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get_page(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        for query in context.captured_queries:
+            self.assertNotIn('OFFSET', query['sql'])
+        return response.json()
+
+    def test_pages_follow_id_when_dates_match(self):
+        url = '/api/recipes/?pagination=cursor&limit=3&fields=id'
+        ids = []
+        pages = []
+        while url:
+            page = self.get_page(url)
+            pages.append(page)
+            ids += [recipe['id'] for recipe in page['results']]
+            url = page['next']
+        self.assertEqual(ids, self.ids)
+        previous = self.get_page(pages[-1]['previous'])
+        self.assertEqual(previous['results'], pages[-2]['results'])
+
+    def test_malformed_position_is_not_found(self):
+        for position in (
+            '["x", "y"]', '["2024-01-01", "abc"]', '["2024-01-01"]',
+            '{"p": 1}', '[null, 1]', 'x',
+        ):
+            with self.subTest(position=position):
+                cursor = base64.b64encode(
+                    urlencode({'p': position}).encode()
+                ).decode()
+                response = self.client.get(
+                    '/api/recipes/?pagination=cursor&'
+                    + urlencode({'cursor': cursor})
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Полнотекстовый поиск работает в PostgreSQL')
+class RecipeSearchTest(TestCase):
+    """Поиск учитывает морфологию и опечатки в названии, а совпадение
+    в названии важнее совпадения в описании."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.soup = Recipe.objects.create(
+            author=author, name='Суп', text='Суп с курицей и лапшой',
+            image='recipes/image.png'
+        )
+        cls.chicken = Recipe.objects.create(
+            author=author, name='Курица с рисом', text='Запеченная курица',
+            image='recipes/image.png'
+        )
+        cls.pie = Recipe.objects.create(
+            author=author, name='Пирог', text='Сладкий',
+            image='recipes/image.png'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, value):
+        response = self.client.get(f'/api/recipes/?search={value}&fields=id')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_name_match_ranks_above_text_match(self):
+        self.assertEqual(
+            self.search('курица'), [self.chicken.id, self.soup.id]
+        )
+
+    def test_typo_in_name_matches_by_trigrams(self):
+        self.assertEqual(self.search('Пирок'), [self.pie.id])
+
+    def test_vector_follows_edits(self):
+        self.pie.name = 'Пирог с курицей'
+        self.pie.save()
+        self.assertIn(self.pie.id, self.search('курица'))
+
+    def test_search_rejects_cursor_pagination(self):
+        response = self.client.get(
+            '/api/recipes/?search=курица&pagination=cursor'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('search', response.json())
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_bulk_generated_recipes_are_searchable(self):
+        self.addCleanup(shutil.rmtree, settings.MEDIA_ROOT, True)
+        call_command('generate_dataset', users=3, recipes=2,
+                     stdout=io.StringIO())
+        recipes = Recipe.objects.filter(author__username__startswith='bench_')
+        self.assertTrue(recipes.exists())
+        self.assertFalse(recipes.filter(search_vector=None).exists())
+
+
+@override_settings(FEED_FANOUT_LIMIT=1)
+class FeedFanoutTest(TestCase):
+    """Рецепты автора остаются в ленте, когда число его подписчиков
+    опускается до FEED_FANOUT_LIMIT."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.other = create_user('other')
+        for user in (cls.reader, cls.other):
+            Follow.objects.create(user=user, author=cls.author)
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='recipes/image.png'
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def get_feed(self):
+        response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_feed_keeps_recipes_after_crossing_limit(self):
+        self.assertEqual(self.get_feed(), [self.recipe.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(user=self.other).delete()
+        self.assertEqual(self.get_feed(), [self.recipe.id])
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.reader, recipe=self.recipe
+        ).exists())
+
+
+class DataLoaderTest(TestCase):
+    """data_loader идемпотентен на обоих путях записи: COPY
+    в PostgreSQL и пакетной записи через ORM."""
+
+    INGREDIENTS = [('Мука', 'г'), ('Сахар', 'г'), ('Мука', 'кг')]
+    TAGS = [
+        {'name': 'Завтрак', 'slug': 'breakfast'},
+        {'name': 'Ужин', 'slug': 'dinner'},
+    ]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        os.mkdir(os.path.join(directory, 'data'))
+        self.write_data(directory)
+        cwd = os.getcwd()
+        os.chdir(directory)
+        self.addCleanup(os.chdir, cwd)
+
+    def write_data(self, directory, tags=None):
+        with open(os.path.join(directory, 'data', 'ingredients.csv'), 'w',
+                  encoding='utf-8', newline='') as file:
+            csv.writer(file).writerows(self.INGREDIENTS)
+        with open(os.path.join(directory, 'data', 'tags.json'), 'w',
+                  encoding='utf-8') as file:
+            json.dump(tags or self.TAGS, file, ensure_ascii=False)
+
+    def load(self, *args):
+        stdout = io.StringIO()
+        call_command('data_loader', *args, '--batch-size', '2',
+                     stdout=stdout, stderr=io.StringIO())
+        return stdout.getvalue()
+
+    def assert_loaded(self):
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list(
+                'name', 'measurement_unit'
+            )),
+            sorted(self.INGREDIENTS)
+        )
+        self.assertEqual(
+            list(Tag.objects.order_by('slug').values('name', 'slug')),
+            self.TAGS
+        )
+
+    def assert_idempotent(self):
+        output = self.load()
+        self.assertIn('записано: 3', output)
+        self.assert_loaded()
+        output = self.load()
+        self.assertEqual(output.count('записано: 0'), 2)
+        self.assert_loaded()
+        # Повторная загрузка обновляет поля вне ключа уникальности.
+        self.TAGS = [{'name': 'Ранний завтрак', 'slug': 'breakfast'},
+                     self.TAGS[1]]
+        self.write_data('.', self.TAGS)
+        self.assertIn('записано: 1', self.load('json'))
+        self.assert_loaded()
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY есть в PostgreSQL')
+    def test_copy_upsert_is_idempotent(self):
+        with mock.patch.object(Command, 'bulk_upsert') as bulk_upsert:
+            self.assert_idempotent()
+        bulk_upsert.assert_not_called()
+
+    def test_orm_upsert_is_idempotent(self):
+        with mock.patch.object(connection, 'vendor', 'sqlite'), \
+                mock.patch.object(Command, 'copy_upsert') as copy_upsert:
+            self.assert_idempotent()
+        copy_upsert.assert_not_called()
+
+    def test_dry_run_writes_nothing(self):
+        generation = get_response_generation('tags')
+        output = self.load('--dry-run')
+        self.assertIn('записано: 3', output)
+        self.assertFalse(Ingredient.objects.exists())
+        self.assertFalse(Tag.objects.exists())
+        self.assertEqual(get_response_generation('tags'), generation)
+
+
+class ImageJobTest(TestCase):
+    """Изображение ставится в очередь при любом сохранении модели,
+    а брошенные задания забираются повторно."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='recipes/image.png'
+        )
+
+    def jobs(self, instance, field):
+        return list(ImageJob.objects.filter(
+            model=instance._meta.label_lower, object_id=instance.pk,
+            field=field
+        ).values_list('image', flat=True))
+
+    def test_model_save_enqueues_changed_image(self):
+        self.assertEqual(self.jobs(self.recipe, 'image'),
+                         ['recipes/image.png'])
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        recipe.name = 'Новое название'
+        recipe.save()
+        recipe.image = 'recipes/other.png'
+        recipe.save()
+        self.assertEqual(self.jobs(self.recipe, 'image'),
+                         ['recipes/image.png', 'recipes/other.png'])
+        user = User.objects.get(pk=self.author.pk)
+        user.avatar = 'users/avatar.png'
+        user.save()
+        self.assertEqual(self.jobs(user, 'avatar'), ['users/avatar.png'])
+
+    def test_stale_processing_job_is_reclaimed(self):
+        ImageJob.objects.update(status=ImageJob.PROCESSING,
+                                locked_at=django_timezone.now())
+        self.assertEqual(claim_jobs(10), [])
+        ImageJob.objects.update(
+            locked_at=django_timezone.now() - timedelta(
+                seconds=settings.IMAGE_JOB_TIMEOUT + 1
+            )
+        )
+        self.assertEqual(
+            [job.object_id for job in claim_jobs(10)], [self.recipe.pk]
+        )
+        self.assertEqual(claim_jobs(10), [])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_ORIGINAL_MAX_SIZE=64,
+                   IMAGE_THUMBNAIL_FORMAT='WEBP')
+class ImageProcessingTest(TestCase):
+    """Воркер перекодирует оригинал, создает миниатюры и удаляет
+    замененную загрузку."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+
+    def files(self, directory):
+        storage = Recipe._meta.get_field('image').storage
+        if not storage.exists(directory):
+            return set()
+        return set(storage.listdir(directory)[1])
+
+    def process(self, job):
+        # Внутри транзакции TestCase соединение закрывать нельзя.
+        with mock.patch('recipes.images.close_old_connections'):
+            process_job(job)
+        self.assertEqual(job.status, ImageJob.DONE, job.error)
+
+    def upload(self, size, image_format='PNG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size).save(buffer, image_format)
+        storage = Recipe._meta.get_field('image').storage
+        name = storage.save(f'recipes/upload.{image_format.lower()}',
+                            ContentFile(buffer.getvalue()))
+        recipe = Recipe.objects.create(author=self.author, name='Рецепт',
+                                       image=name)
+        return recipe, ImageJob.objects.get(object_id=recipe.pk,
+                                            model='recipes.recipe')
+
+    def test_original_is_reencoded_and_upload_removed(self):
+        recipe, job = self.upload((200, 100))
+        self.process(job)
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.image.name.endswith('.webp'))
+        storage = recipe.image.storage
+        self.assertFalse(storage.exists(job.image))
+        with recipe.image.open('rb') as file, Image.open(file) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (64, 32)))
+        self.assertEqual(set(recipe.image_thumbnails), {'card', 'detail'})
+        for path in recipe.image_thumbnails.values():
+            self.assertTrue(storage.exists(path))
+
+    def test_small_original_in_target_format_is_kept(self):
+        recipe, job = self.upload((32, 32), 'WEBP')
+        self.process(job)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image.name, job.image)
+        self.assertTrue(recipe.image.storage.exists(job.image))
+
+    def test_replaced_image_keeps_upload_and_drops_results(self):
+        recipe, job = self.upload((200, 100))
+        storage = recipe.image.storage
+        reencode = images.reencode_original
+
+        def replace_during_processing(*args):
+            # Пока воркер обрабатывал файл, пользователь загрузил новый.
+            Recipe.objects.filter(pk=recipe.pk).update(
+                image='recipes/new.png'
+            )
+            return reencode(*args)
+
+        with mock.patch.object(images, 'reencode_original',
+                               replace_during_processing):
+            self.process(job)
+        self.assertEqual(self.files('recipes'),
+                         {os.path.basename(job.image)})
+        self.assertEqual(self.files('thumbnails'), set())
+        self.assertTrue(storage.exists(job.image))
+
+
+class ShortLinkResolverTest(TestCase):
+    """Коды последних рецептов загружаются в LRU одним запросом при
+    первом переходе, а не при импорте."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}',
+                image='recipes/image.png'
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_resolve_prewarms_local_cache(self):
+        with self.assertNumQueries(0):
+            resolver = ShortLinkResolver(maxsize=10, prewarm=10)
+        with self.assertNumQueries(1):
+            for recipe in self.recipes:
+                self.assertEqual(
+                    resolver.resolve(recipe.short_code), recipe.pk
+                )
+        self.assertIsNone(cache.get(f'short_link:{recipe.short_code}'))
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'Бюджеты запросов заданы для PostgreSQL')
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTest(TestCase):
+    """Представления укладываются в QUERY_BUDGETS, включая запрос
+    токена при холодном кэше."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.other = create_user('other')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        Tag.objects.create(name='Другой тег', slug='other')
+        cls.ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='recipes/image.png'
+        )
+        TagInRecipe.objects.create(recipe=cls.recipe, tag=cls.tag)
+        IngredientInRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=1
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        # Сигналы сбрасывают соответствие слагов после фиксации, которой
+        # в TestCase нет.
+        tag_slugs.invalidate()
+
+    def request(self, method, url, status):
+        # Новый токен не закэширован ни в процессе, ни в общем кэше.
+        Token.objects.filter(user=self.reader).delete()
+        token = Token.objects.create(user=self.reader)
+        cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = getattr(client, method)(url)
+        self.assertEqual(response.status_code, status)
+
+    def test_views_stay_within_budget(self):
+        recipe = f'/api/recipes/{self.recipe.id}/'
+        subscribe = f'/api/users/{self.other.id}/subscribe/'
+        requests = (
+            ('get', '/api/tags/', 200),
+            ('get', f'/api/tags/{self.tag.id}/', 200),
+            ('get', '/api/ingredients/?name=Инг', 200),
+            ('get', f'/api/ingredients/{self.ingredient.id}/', 200),
+            ('get', '/api/recipes/', 200),
+            ('get', '/api/recipes/?tags=tag&tags=other', 200),
+            ('get', recipe, 200),
+            ('get', '/api/recipes/feed/', 200),
+            ('post', f'{recipe}favorite/', 201),
+            ('delete', f'{recipe}favorite/', 204),
+            ('post', f'{recipe}shopping_cart/', 201),
+            ('get', '/api/recipes/download_shopping_cart/', 200),
+            ('delete', f'{recipe}shopping_cart/', 204),
+            ('get', '/api/users/subscriptions/', 200),
+            ('post', subscribe, 201),
+            ('delete', subscribe, 204),
+        )
+        for method, url, status in requests:
+            with self.subTest(method=method, url=url):
+                self.request(method, url, status)
+
+    @override_settings(FAST_RECIPE_LIST=False)
+    def test_tag_filter_stays_within_budget(self):
+        # Первый запрос строит соответствие слагов, следующий берет его
+        # из памяти и не обращается к тегам.
+        url = '/api/recipes/?tags=tag&tags=other'
+        self.request('get', url, 200)
+        with CaptureQueriesContext(connection) as context:
+            self.request('get', url, 200)
+        self.assertFalse(any(
+            'FROM "recipes_tag"' in query['sql']
+            and 'recipes_taginrecipe' not in query['sql']
+            for query in context.captured_queries
+        ))
+
+
+class RequestMetricsTest(TestCase):
+    """Server-Timing отдает время сериализации без работы представления,
+    а /metrics без токена открыт только при DEBUG."""
+
+    DELAY = 0.05
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Тег', slug='tag')
+
+    def serializer_time(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response.status_code, 200)
+        timings = {}
+        for item in response['Server-Timing'].split(', '):
+            name, duration = item.split(';')[:2]
+            timings[name] = float(duration[len('dur='):]) / 1000
+        return timings['serializer']
+
+    def sleep(self, result):
+        def slow(*args, **kwargs):
+            time.sleep(self.DELAY)
+            return result(*args, **kwargs)
+        return slow
+
+    def test_serializer_time_excludes_view_work(self):
+        with mock.patch(
+            'api.views.TagViewSet.filter_queryset',
+            self.sleep(lambda view, queryset: queryset)
+        ):
+            self.assertLess(self.serializer_time(), self.DELAY)
+        with mock.patch(
+            'api.serializers.TagSerializer.to_representation',
+            self.sleep(lambda serializer, instance: {})
+        ):
+            self.assertGreaterEqual(self.serializer_time(), self.DELAY)
+
+    def test_metrics_require_token_outside_debug(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with override_settings(METRICS_TOKEN='secret'):
+            for header, status in (
+                ({}, 403),
+                ({'HTTP_AUTHORIZATION': 'Bearer other'}, 403),
+                ({'HTTP_AUTHORIZATION': 'Bearer secret'}, 200),
+            ):
+                with self.subTest(header=header):
+                    self.assertEqual(
+                        self.client.get('/metrics', **header).status_code,
+                        status
+                    )
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ShoppingCartCacheTest(TestCase):
+    """Список покупок кэшируется, отдается с ETag и сбрасывается
+    сигналами корзины, ингредиентов рецепта и ингредиентов."""
+
+    DOWNLOAD_URL = '/api/recipes/download_shopping_cart/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = create_user('reader')
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Тег', slug='tag')
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', image='recipes/image.png'
+        )
+        IngredientInRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=100
+        )
+        ShoppingCart.objects.create(user=cls.reader, recipe=cls.recipe)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        self.key = shopping_cart_key(self.reader.id)
+
+    def download(self, **headers):
+        response = self.client.get(self.DOWNLOAD_URL, **headers)
+        content = b''.join(getattr(response, 'streaming_content', ()))
+        return response, content.decode()
+
+    def assert_invalidated(self, change):
+        self.download()
+        self.assertIsNotNone(cache.get(self.key))
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertIsNone(cache.get(self.key))
+
+    def test_second_download_is_served_from_cache(self):
+        _, content = self.download()
+        self.assertIn('Мука  - 100(г)', content)
+        with CaptureQueriesContext(connection) as context:
+            _, cached = self.download()
+        self.assertEqual(cached, content)
+        self.assertFalse(any(
+            'recipes_ingredientinrecipe' in query['sql']
+            for query in context.captured_queries
+        ))
+
+    def test_matching_etag_returns_not_modified(self):
+        response, _ = self.download()
+        etag = response['ETag']
+        response, content = self.download(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(content, '')
+        response, _ = self.download(HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_changes_with_cart_contents(self):
+        response, _ = self.download()
+        with self.captureOnCommitCallbacks(execute=True):
+            row = IngredientInRecipe.objects.get(recipe=self.recipe)
+            row.amount = 200
+            row.save()
+        changed, content = self.download(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], response['ETag'])
+        self.assertIn('Мука  - 200(г)', content)
+
+    def test_cart_changes_invalidate_cache(self):
+        url = f'/api/recipes/{self.recipe.id}/shopping_cart/'
+        self.assert_invalidated(lambda: self.client.delete(url))
+        self.assert_invalidated(lambda: self.client.post(url))
+
+    def test_recipe_ingredient_changes_invalidate_cache(self):
+        other = Ingredient.objects.create(name='Сахар', measurement_unit='г')
+        author = APIClient()
+        author.force_authenticate(self.author)
+        url = f'/api/recipes/{self.recipe.id}/'
+
+        def update(ingredients):
+            response = author.patch(url, {
+                'ingredients': [
+                    {'id': ingredient.id, 'amount': amount}
+                    for ingredient, amount in ingredients
+                ],
+                'tags': [self.tag.id],
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 10,
+                'image': image_data(),
+            }, format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+
+        for ingredients in (
+            [(self.ingredient, 150)],
+            [(self.ingredient, 150), (other, 50)],
+            [(other, 50)],
+        ):
+            with self.subTest(ingredients=ingredients):
+                self.assert_invalidated(lambda: update(ingredients))
+        self.assert_invalidated(lambda: author.delete(url))
+
+    def test_ingredient_changes_invalidate_cache(self):
+        def rename():
+            self.ingredient.name = 'Мука пшеничная'
+            self.ingredient.save()
+
+        self.assert_invalidated(rename)
+        self.assert_invalidated(self.ingredient.delete)
+
+
+@override_settings(SHARED_CACHE=True, AUTH_SIGNED_TOKENS=True)
+class TokenRevocationTest(TestCase):
+    """Смена прав, пароля и выход отзывают токены, даже если кэш
+    потерял поколение."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'password'
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()['auth_token']
+
+    def get_me(self, token):
+        return APIClient().get(
+            '/api/users/me/', HTTP_AUTHORIZATION=f'Token {token}'
+        ).status_code
+
+    def test_role_change_revokes_signed_token(self):
+        token = self.login()
+        self.assertIn(':', token)
+        self.assertEqual(self.get_me(token), 200)
+        user = User.objects.get(pk=self.user.pk)
+        user.is_staff = True
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.get_me(token), 401)
+        cache.clear()
+        self.assertEqual(self.get_me(token), 401)
+        self.assertEqual(self.get_me(self.login()), 200)
+
+    def test_logout_revokes_signed_token(self):
+        token = self.login()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(
+                '/api/auth/token/logout/',
+                HTTP_AUTHORIZATION=f'Token {token}'
+            )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_me(token), 401)
+
+    @override_settings(AUTH_SIGNED_TOKENS=False)
+    def test_password_change_refreshes_cached_snapshot(self):
+        token = self.login()
+        self.assertEqual(self.get_me(token), 200)
+        cache_key = token_cache_key(token)
+        cached = local_tokens.get(cache_key)
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new password')
+        user.is_superuser = True
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        # Другой процесс успел вернуть в общий кэш снимок, снятый
+        # до изменения.
+        cache.set(cache_key, cached)
+        response = APIClient().get(
+            '/api/users/me/', HTTP_AUTHORIZATION=f'Token {token}'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.wsgi_request.user.is_superuser)
+
+    @override_settings(AUTH_SIGNED_TOKENS=False)
+    def test_local_snapshot_skips_shared_cache(self):
+        token = self.login()
+        self.assertEqual(self.get_me(token), 200)
+        with mock.patch.object(cache, 'get') as cache_get, \
+                CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.get_me(token), 200)
+        cache_get.assert_not_called()
+        for query in context.captured_queries:
+            self.assertNotIn('authtoken_token', query['sql'])
+            self.assertNotIn('token_generation', query['sql'])
+
+    @override_settings(SHARED_CACHE=False)
+    def test_signed_tokens_require_shared_cache(self):
+        self.assertNotIn(':', self.login())
+
+
+@skipUnless('replica_1' in settings.DATABASES,
+            'Нужна реплика-зеркало из foodgram.test_settings')
+@override_settings(REPLICA_DATABASES=['replica_1'])
+class ReplicaRoutingTest(TestCase):
+    """Чтение после записи и поиск токена идут в основную базу."""
+
+    databases = {'default', 'replica_1'}.intersection(settings.DATABASES)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = Recipe.objects.create(
+            author=create_user('author'), name='Рецепт',
+            image='recipes/image.png'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def request(self, method, url, status, **extra):
+        """Возвращает число запросов к основной базе и к реплике."""
+
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica_1']) as replica:
+            response = getattr(self.client, method)(url, **extra)
+        self.assertEqual(response.status_code, status)
+        return len(primary), len(replica)
+
+    def test_read_after_write_uses_primary(self):
+        self.client.force_authenticate(self.user)
+        _, replica = self.request('get', '/api/recipes/', 200)
+        self.assertGreater(replica, 0)
+        self.request('post', f'/api/recipes/{self.recipe.id}/favorite/', 201)
+        primary, replica = self.request('get', '/api/recipes/', 200)
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def async_request(self, method, url, status):
+        """Запрос через ASGI; возвращает число запросов к реплике."""
+
+        async def send():
+            # AsyncClient в Django 3.2 передает extra как заголовки ASGI.
+            return await getattr(AsyncClient(), method)(
+                url, authorization=f'Token {self.token.key}'
+            )
+
+        with CaptureQueriesContext(connections['replica_1']) as replica:
+            response = async_to_sync(send)()
+        self.assertEqual(response.status_code, status)
+        return len(replica)
+
+    def test_async_read_after_write_uses_primary(self):
+        self.assertGreater(self.async_request('get', '/api/recipes/', 200), 0)
+        self.async_request('post', f'/api/recipes/{self.recipe.id}/favorite/',
+                           201)
+        self.assertEqual(self.async_request('get', '/api/recipes/', 200), 0)
+
+    def test_token_after_login_is_read_from_primary(self):
+        response = self.client.post('/api/auth/token/login/', {
+            'email': self.user.email, 'password': 'password'
+        })
+        self.assertEqual(response.status_code, 200)
+        token = response.json()['auth_token']
+        # Запрос с токеном не закреплен: ключ закрепления входа был другим.
+        self.request('get', '/api/users/me/', 200,
+                     HTTP_AUTHORIZATION=f'Token {token}')
+
+    def test_database_cache_is_read_from_primary(self):
+        cache_model = DatabaseCache('cache_table', {}).cache_model_class
+        replica = current_replica.set('replica_1')
+        try:
+            self.assertEqual(router.db_for_read(cache_model), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(Recipe), 'replica_1')
+        finally:
+            current_replica.reset(replica)
+
+
+class AsyncMiddlewareTest(SimpleTestCase):
+    """Под ASGI цепочка middleware не уходит в поток целиком."""
+
+    def test_middleware_chain_is_async(self):
+        self.assertNotIsInstance(ASGIHandler()._middleware_chain, SyncToAsync)
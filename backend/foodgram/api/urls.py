@@ -1,6 +1,8 @@
-from django.urls import include, path
+from django.conf import settings
+from django.urls import URLPattern, include, path
 from rest_framework import routers
 
+from .async_views import async_view
 from .views import (IngredientViewSet, TagViewSet, UserViewSet,
                     RecipeViewSet)
 
@@ -11,8 +13,19 @@ router.register('ingredients', IngredientViewSet, basename='ingredients')
 router.register('recipes', RecipeViewSet, basename='recipes')
 router.register('users', UserViewSet, basename='users')
 
+# Маршруты, которые в режиме ASGI обслуживаются асинхронно.
+ASYNC_ROUTES = ('recipes-list', 'recipes-detail', 'ingredients-list')
+
+router_urls = router.urls
+if settings.ASYNC_VIEWS:
+    router_urls = [
+        URLPattern(url.pattern, async_view(url.callback),
+                   url.default_args, url.name)
+        if url.name in ASYNC_ROUTES else url
+        for url in router_urls
+    ]
 
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
     path('auth/', include('djoser.urls.authtoken')),
 ]
@@ -1,5 +1,13 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+import csv
+
+from django.conf import settings
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Q, Subquery, Value)
+from django.http import (HttpResponse, HttpResponseForbidden,
+                         HttpResponseNotModified, StreamingHttpResponse)
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import parse_etags, quote_etag
 from rest_framework.permissions import (
     AllowAny, IsAuthenticatedOrReadOnly, IsAuthenticated
 )
@@ -7,6 +15,7 @@ from django.urls import reverse
 from django.shortcuts import get_object_or_404, redirect
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import LimitOffsetPagination
 from rest_framework import viewsets, status
 
@@ -14,51 +23,193 @@ from rest_framework.viewsets import ModelViewSet
 from djoser.views import UserViewSet
 from rest_framework.response import Response
 
-from .pagination import CustomPagination
+from .authentication import SNAPSHOT_FIELDS
+from .autocomplete import ingredient_index
+from .cache import AnonymousResponseCacheMixin, get_shopping_cart
+from .fieldsets import get_columns, get_response_fields
+from .metrics import registry
+from .pagination import (CursorPaginationMixin, CustomPagination,
+                         RecipeCursorPagination,
+                         SubscriptionCursorPagination)
 from .permissions import IsAuthorOrReadOnly
+from .relations import add_relation, delete_relation
+from .renderers import ShoppingListCSVRenderer, ShoppingListTxtRenderer
+from .shortlinks import short_links
 from recipes.models import (Ingredient, Tag, Recipe, Follow,
-                            IngredientInRecipe, ShoppingCart, Favorite)
+                            IngredientInRecipe, ShoppingCart, Favorite,
+                            TimelineEntry)
 
 from .serializers import (IngredientSerializer, TagSerializer,
                           UserProfileSerializer, AvatarSerializer,
-                          RecipeSerializer, FollowSerializer,
+                          RecipeSerializer, RecipeMiniSerializer,
+                          RecipeRowSerializer, FollowSerializer,
                           CreateRecipeSerializer)
 from users.models import User
 from .filters import IngredientFilter, RecipeFilter
 
+RECIPE_BASE_FIELDS = ('id', 'author', 'pub_date')
+# Столбцы, которые читает каждое поле ответа; text и изображения
+# не загружаются, если поле не запрошено.
+RECIPE_FIELD_COLUMNS = {
+    'name': ('name',),
+    'image': ('image',),
+    'thumbnails': ('image', 'image_thumbnails'),
+    'text': ('text',),
+    'cooking_time': ('cooking_time',),
+}
+USER_FIELD_COLUMNS = {
+    'email': ('email',),
+    'username': ('username',),
+    'first_name': ('first_name',),
+    'last_name': ('last_name',),
+    'avatar': ('avatar',),
+    'avatar_thumbnails': ('avatar', 'avatar_thumbnails'),
+    'recipes_count': ('recipes_count',),
+}
+AUTHOR_READ_FIELDS = ('id', 'email', 'username', 'first_name', 'last_name',
+                      'avatar', 'avatar_thumbnails')
+SUBSCRIPTION_RECIPE_FIELDS = ('id', 'author', 'name', 'image', 'cooking_time',
+                              'pub_date')
+RECIPE_MINI_FIELDS = ('id', 'name', 'image', 'cooking_time')
+RECIPE_RELATION_PLACES = {Favorite: 'избранном', ShoppingCart: 'корзине'}
+INGREDIENT_IN_RECIPE_READ_FIELDS = ('id', 'recipe', 'amount',
+                                    'ingredient__id', 'ingredient__name',
+                                    'ingredient__measurement_unit')
+
+
+class Echo:
+    """Псевдобуфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
 
 def redirect_short_link(request, short_code):
-    """Перенаправление по короткой ссылке на рецепт."""
-    try:
-        recipe = Recipe.objects.get(short_code=short_code)
-        return redirect(f'/recipes/{recipe.pk}/')
-    except Recipe.DoesNotExist:
+    """Перенаправление по короткой ссылке на рецепт.
+
+    Код рецепта не меняется, поэтому редирект постоянный и кэшируется
+    браузером и прокси.
+    """
+    pk = short_links.resolve(short_code)
+    if pk is None:
         return redirect('/404/')
+    response = redirect(f'/recipes/{pk}/', permanent=True)
+    patch_cache_control(
+        response, public=True, max_age=settings.SHORT_LINK_MAX_AGE
+    )
+    return response
+
+
+def metrics(request):
+    """Метрики процесса в текстовом формате Prometheus.
+
+    Требует METRICS_TOKEN; без токена метрики открыты только при DEBUG.
+    """
+    if settings.METRICS_TOKEN:
+        if not constant_time_compare(
+            request.headers.get('Authorization', ''),
+            f'Bearer {settings.METRICS_TOKEN}'
+        ):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4'
+    )
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(AnonymousResponseCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     """Вьюсет для работы с обьектами класса Ingredient."""
 
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     filter_backends = (IngredientFilter,)
     search_fields = ('^name',)
 
+    def list(self, request, *args, **kwargs):
+        """Поиск по началу названия обслуживается индексом в памяти.
+
+        При INGREDIENT_INDEX_TTL=0 поиск выполняется в базе с тем же
+        порядком и ограничением INGREDIENT_AUTOCOMPLETE_LIMIT.
+        """
+
+        terms = IngredientFilter().get_search_terms(request)
+        if not terms:
+            return super().list(request, *args, **kwargs)
+        limit = settings.INGREDIENT_AUTOCOMPLETE_LIMIT
+        if settings.INGREDIENT_INDEX_TTL:
+            return Response(ingredient_index.search(terms[0], limit))
+        queryset = self.filter_queryset(self.get_queryset())[:limit]
+        return Response(self.get_serializer(queryset, many=True).data)
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(AnonymousResponseCacheMixin, viewsets.ReadOnlyModelViewSet):
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
 
-class UserViewSet(UserViewSet):
+class UserViewSet(CursorPaginationMixin, UserViewSet):
     """Вьюсет для работы с обьектами класса User и подписки на авторов."""
 
     queryset = User.objects.all()
     serializer_class = UserProfileSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = LimitOffsetPagination
+    cursor_pagination_classes = {'subscriptions': SubscriptionCursorPagination}
+
+    def get_instance(self):
+        """Текущий пользователь для /users/me/.
+
+        Пользователь из подписанного токена содержит только id и права,
+        остальные поля профиля загружаются одним запросом.
+        """
+
+        user = self.request.user
+        deferred = user.get_deferred_fields() & set(SNAPSHOT_FIELDS)
+        if deferred:
+            user.refresh_from_db(fields=deferred)
+        return user
+
+    def get_queryset(self):
+        """Столбцы профиля по ?fields= и ?omit=, подписка — EXISTS."""
+
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        fields = get_response_fields(
+            self.request, UserProfileSerializer.Meta.fields
+        )
+        queryset = queryset.only(*get_columns(fields, USER_FIELD_COLUMNS))
+        user = self.request.user
+        if 'is_subscribed' in fields and user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Follow.objects.filter(user=user, author=OuterRef('pk'))
+            ))
+        return queryset
+
+    @staticmethod
+    def get_subscription_recipes(recipes_limit):
+        """Рецепты авторов страницы подписок одним запросом.
+
+        При заданном recipes_limit для каждого автора выбираются только
+        последние recipes_limit рецептов коррелированным подзапросом.
+        """
+
+        recipes = Recipe.objects.only(*SUBSCRIPTION_RECIPE_FIELDS)
+        try:
+            recipes_limit = int(recipes_limit)
+        except (TypeError, ValueError):
+            return recipes
+        return recipes.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('pk')[:max(recipes_limit, 0)]
+        ))
 
     @action(
         detail=False,
@@ -70,7 +221,19 @@ class UserViewSet(UserViewSet):
     def subscriptions(self, request):
         """Метод для создания страницы подписок"""
 
-        queryset = User.objects.filter(follow__user=request.user)
+        fields = get_response_fields(request, FollowSerializer.Meta.fields)
+        queryset = User.objects.filter(
+            follow__user=request.user
+        ).only(*get_columns(fields, USER_FIELD_COLUMNS)).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        )
+        if 'recipes' in fields:
+            queryset = queryset.prefetch_related(Prefetch(
+                'recipes',
+                queryset=self.get_subscription_recipes(
+                    request.query_params.get('recipes_limit')
+                )
+            ))
         pages = self.paginate_queryset(queryset)
         serializer = FollowSerializer(pages, many=True,
                                       context={'request': request})
@@ -87,19 +250,35 @@ class UserViewSet(UserViewSet):
         """Метод для управления подписками """
 
         user = request.user
-        author = get_object_or_404(User, id=id)
-        serializer = FollowSerializer(
-            author,
-            data=request.data,
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
+        if not str(id).isdigit():
+            raise NotFound
         if request.method == 'POST':
-            Follow.objects.create(user=user, author=author)
+            if int(id) == user.id:
+                raise ValidationError(
+                    {"error": "Нельзя подписаться на самого себя"}
+                )
+            author, created = add_relation(
+                Follow, user, 'author', id,
+                AUTHOR_READ_FIELDS + ('recipes_count',)
+            )
+            if author is None:
+                raise NotFound
+            if not created:
+                raise ValidationError(
+                    {"error": "Вы уже подписаны на этого пользователя"}
+                )
+            author.is_subscribed = True
+            serializer = FollowSerializer(
+                author, context={'request': request}
+            )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         elif request.method == 'DELETE':
-            Follow.objects.filter(user=user, author=author).delete()
+            if not delete_relation(Follow, user, 'author', id):
+                get_object_or_404(User.objects.only('id'), id=id)
+                raise ValidationError(
+                    {"error": "Вы не подписаны на этого пользователя"}
+                )
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['PUT', 'DELETE'], url_path='me/avatar')
@@ -122,20 +301,125 @@ class UserViewSet(UserViewSet):
         return Response(serializer.data)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(CursorPaginationMixin, AnonymousResponseCacheMixin,
+                    ModelViewSet):
     """ViewSet для обработки запросов, связанных с рецептами."""
 
+    cache_namespace = 'recipes'
     queryset = Recipe.objects.all()
     pagination_class = CustomPagination
+    cursor_pagination_classes = {
+        'list': RecipeCursorPagination,
+        'feed': RecipeCursorPagination,
+    }
     permission_classes = (IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        """Метод для выбора плана загрузки рецептов.
+
+        Для чтения связи подгружаются одним запросом на страницу,
+        а флаги избранного, корзины и подписки на автора вычисляются
+        подзапросами EXISTS. Столбцы, связи и подзапросы для полей,
+        не вошедших в ?fields= или исключенных ?omit=, не загружаются.
+        """
+
+        queryset = super().get_queryset()
+        user = self.request.user
+        fields = get_response_fields(
+            self.request, RecipeSerializer.Meta.fields
+        )
+        if self.use_row_serializer():
+            return self.get_row_queryset(queryset, user, fields)
+        read_action = self.action in ('list', 'retrieve', 'feed')
+        columns = get_columns(fields, RECIPE_FIELD_COLUMNS, RECIPE_BASE_FIELDS)
+        if read_action:
+            queryset = queryset.only(*columns)
+            if 'tags' in fields:
+                queryset = queryset.prefetch_related('tags')
+            if 'ingredients' in fields:
+                queryset = queryset.prefetch_related(Prefetch(
+                    'ingredient_list',
+                    queryset=IngredientInRecipe.objects.select_related(
+                        'ingredient'
+                    ).only(*INGREDIENT_IN_RECIPE_READ_FIELDS)
+                ))
+        if user.is_anonymous:
+            if read_action and 'author' in fields:
+                return queryset.select_related('author').only(
+                    *columns,
+                    *(f'author__{field}' for field in AUTHOR_READ_FIELDS)
+                )
+            return queryset
+        if 'is_favorited' in fields:
+            queryset = queryset.annotate(is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ))
+        if 'is_in_shopping_cart' in fields:
+            queryset = queryset.annotate(is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ))
+        if 'author' in fields:
+            authors = User.objects.only(*AUTHOR_READ_FIELDS).annotate(
+                is_subscribed=Exists(
+                    Follow.objects.filter(user=user, author=OuterRef('pk'))
+                )
+            )
+            queryset = queryset.prefetch_related(
+                Prefetch('author', queryset=authors)
+            )
+        return queryset
+
+    def use_row_serializer(self):
+        return settings.FAST_RECIPE_LIST and self.action in ('list', 'feed')
+
+    @staticmethod
+    def get_row_queryset(queryset, user, fields):
+        """Строки values() для RecipeRowSerializer.
+
+        Автор читается в том же запросе, флаги вычисляются
+        подзапросами EXISTS; ненужные полям ответа столбцы
+        и подзапросы пропускаются.
+        """
+
+        columns = list(
+            get_columns(fields, RECIPE_FIELD_COLUMNS, RECIPE_BASE_FIELDS)
+        )
+        if 'author' in fields:
+            columns += (
+                f'author__{field}' for field in AUTHOR_READ_FIELDS
+                if field != 'id'
+            )
+        annotations = {}
+        if not user.is_anonymous:
+            if 'is_favorited' in fields:
+                annotations['is_favorited'] = Exists(
+                    Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+                )
+            if 'is_in_shopping_cart' in fields:
+                annotations['is_in_shopping_cart'] = Exists(
+                    ShoppingCart.objects.filter(
+                        user=user, recipe=OuterRef('pk')
+                    )
+                )
+            if 'author' in fields:
+                annotations['is_subscribed'] = Exists(Follow.objects.filter(
+                    user=user, author=OuterRef('author')
+                ))
+        return queryset.annotate(**annotations).values(
+            *columns, *annotations
+        )
+
     def get_serializer_class(self):
         """Метод для вызова определенного сериализатора. """
 
-        if self.action in ('list', 'retrieve', 'favorite', 'shopping_cart'):
+        if self.use_row_serializer():
+            return RecipeRowSerializer
+        if self.action in ('list', 'retrieve', 'feed'):
             return RecipeSerializer
+        elif self.action in ('favorite', 'shopping_cart'):
+            return RecipeMiniSerializer
         elif self.action in ('create', 'partial_update'):
             return CreateRecipeSerializer
 
@@ -148,27 +432,35 @@ class RecipeViewSet(ModelViewSet):
 
     def _manage_recipe_relation(self, request, pk,
                                 relation_model):
-        """Общий метод для управления связями рецептов."""
+        """Общий метод для управления связями рецептов.
+
+        Добавление и удаление выполняются одним запросом, повторы
+        отсекаются ограничением уникальности.
+        """
         user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
-        serializer = self.get_serializer(recipe)
+        place = RECIPE_RELATION_PLACES[relation_model]
+        if not str(pk).isdigit():
+            raise NotFound
         if request.method == 'POST':
-            if relation_model is Favorite:
-                serializer.validate_recipe_in_favorite(recipe, user)
-            else:
-                serializer.validate_recipe_in_cart(recipe, user)
-
-            relation_model.objects.create(user=user, recipe=recipe)
-            return Response(serializer.data,
+            recipe, created = add_relation(
+                relation_model, user, 'recipe', pk, RECIPE_MINI_FIELDS
+            )
+            if recipe is None:
+                raise NotFound
+            if not created:
+                raise ValidationError(
+                    f'Рецепт "{recipe.name}" уже в {place}.'
+                )
+            return Response(self.get_serializer(recipe).data,
                             status=status.HTTP_201_CREATED)
 
         if request.method == 'DELETE':
-            if relation_model is Favorite:
-                serializer.validate_recipe_not_in_favorite(recipe, user)
-            else:
-                serializer.validate_recipe_not_in_cart(recipe, user)
-
-            relation_model.objects.filter(user=user, recipe=recipe).delete()
+            if not delete_relation(relation_model, user, 'recipe', pk):
+                recipe = get_object_or_404(Recipe.objects.only('name'),
+                                           id=pk)
+                raise ValidationError(
+                    f'Рецепта "{recipe.name}" нет в {place}.'
+                )
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -197,38 +489,98 @@ class RecipeViewSet(ModelViewSet):
             request, pk, ShoppingCart
         )
 
+    @action(
+        detail=False,
+        methods=('get',),
+        permission_classes=(IsAuthenticated,),
+        url_path='feed',
+        url_name='feed',
+    )
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь.
+
+        Рецепты читаются из ленты пользователя; рецепты авторов
+        с большим числом подписчиков добавляются при чтении.
+        """
+
+        user = request.user
+        queryset = self.get_queryset()
+        read_authors = list(Follow.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).values_list('author_id', flat=True))
+        if read_authors:
+            queryset = queryset.filter(
+                Q(pk__in=TimelineEntry.objects.filter(
+                    user=user
+                ).values('recipe'))
+                | Q(author__in=read_authors)
+            )
+        else:
+            queryset = queryset.filter(timeline_entries__user=user).order_by(
+                '-timeline_entries__pub_date', '-timeline_entries__recipe'
+            )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
     @staticmethod
     def ingredients_to_txt(ingredients):
-        """Метод для объединения ингредиентов в список для загрузки"""
+        """Генератор строк списка покупок в текстовом формате."""
 
-        shopping_list = ''
         for ingredient in ingredients:
-            shopping_list += (
+            yield (
                 f"{ingredient['ingredient__name']}  - "
                 f"{ingredient['sum']}"
                 f"({ingredient['ingredient__measurement_unit']})\n"
             )
-        return shopping_list
+
+    @staticmethod
+    def ingredients_to_csv(ingredients):
+        """Генератор строк списка покупок в формате CSV."""
+
+        buffer = Echo()
+        writer = csv.writer(buffer)
+        yield writer.writerow(('Ингредиент', 'Количество', 'Единицы'))
+        for ingredient in ingredients:
+            yield writer.writerow((
+                ingredient['ingredient__name'],
+                ingredient['sum'],
+                ingredient['ingredient__measurement_unit'],
+            ))
 
     @action(
         detail=False,
         methods=('get',),
         permission_classes=(IsAuthenticated,),
+        renderer_classes=(ShoppingListTxtRenderer, ShoppingListCSVRenderer),
         url_path='download_shopping_cart',
         url_name='download_shopping_cart',
     )
     def download_shopping_cart(self, request):
-        """Метод для загрузки ингредиентов и их количества
-         для выбранных рецептов"""
-
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__shoppingcart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(sum=Sum('amount'))
-        shopping_list = self.ingredients_to_txt(ingredients)
-        return HttpResponse(shopping_list, content_type='text/plain')
+        """Метод для потоковой загрузки ингредиентов и их количества
+         для выбранных рецептов. Формат задается параметром ?format="""
+
+        digest, ingredients = get_shopping_cart(request.user)
+        renderer = request.accepted_renderer
+        etag = quote_etag(f'{digest}-{renderer.format}')
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+        if renderer.format == 'csv':
+            content = self.ingredients_to_csv(ingredients)
+        else:
+            content = self.ingredients_to_txt(ingredients)
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
+        response['ETag'] = etag
+        return response
 
     @action(
         detail=True,
@@ -0,0 +1,93 @@
+import time
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+
+from .pool import close_pools, connection_stats, get_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Свободные соединения пула не дают удалить тестовую базу.
+        close_pools(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL с проверкой постоянных соединений и пулом процесса.
+
+    При CONN_HEALTH_CHECKS соединение, пережившее прошлый HTTP-запрос
+    (CONN_MAX_AGE > 0), проверяется перед первым запросом к базе и
+    открывается заново, если сервер его разорвал.
+
+    При POOL_SIZE > 0 соединения берутся из пула процесса и
+    возвращаются в него в конце HTTP-запроса, поэтому потоки и
+    асинхронные представления делят не больше POOL_SIZE соединений,
+    а CONN_MAX_AGE ограничивает возраст соединения в пуле.
+    """
+
+    creation_class = DatabaseCreation
+    health_check_done = False
+    pool = None
+
+    def get_new_connection(self, conn_params):
+        pool_size = self.settings_dict.get('POOL_SIZE')
+        if not pool_size or self.alias == NO_DB_ALIAS:
+            self.pool = None
+            return self.open_connection(conn_params)
+        self.pool = get_pool(self.alias, self.settings_dict, conn_params)
+        connection = self.pool.checkout(
+            lambda: self.open_connection(conn_params)
+        )
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def open_connection(self, conn_params):
+        started = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        connection_stats.add(
+            self.alias, opened=1,
+            connect_seconds=time.perf_counter() - started
+        )
+        return connection
+
+    def connect(self):
+        # Новое соединение не проверяется, в том числе внутри connect().
+        self.health_check_done = True
+        super().connect()
+        if self.pool is not None:
+            # Соединение возвращается в пул в конце HTTP-запроса.
+            self.close_at = time.monotonic()
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            if self.in_atomic_block:
+                # Обертка сохраняет ссылку на соединение до отката,
+                # поэтому в пул его возвращать нельзя.
+                self.pool.discard(self.connection)
+            else:
+                self.pool.checkin(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        # Чтение autocommit здесь не должно запускать проверку.
+        self.health_check_done = True
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and not self.in_atomic_block
+            and self.settings_dict.get('CONN_HEALTH_CHECKS')
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                connection_stats.add(self.alias, health_check_failures=1)
+                self.close()
+        super().ensure_connection()
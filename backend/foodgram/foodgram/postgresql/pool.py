@@ -0,0 +1,232 @@
+import threading
+import time
+
+from psycopg2 import Error, OperationalError
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class ConnectionStats:
+    """Счетчики соединений с базой по псевдонимам из DATABASES."""
+
+    counters = ('opened', 'connect_seconds', 'health_check_failures',
+                'checkouts', 'checkout_wait_seconds', 'timeouts')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def add(self, alias, **values):
+        with self._lock:
+            row = self._values.setdefault(
+                alias, dict.fromkeys(self.counters, 0)
+            )
+            for name, value in values.items():
+                row[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {alias: dict(row) for alias, row in self._values.items()}
+
+
+connection_stats = ConnectionStats()
+
+
+class ConnectionPool:
+    """Пул соединений процесса, общий для всех потоков.
+
+    Свободные соединения выдаются в порядке LIFO, перед выдачей
+    проверяются запросом SELECT 1 (health_checks) и закрываются, если
+    старше max_age секунд. Если заняты все size соединений, поток ждет
+    освобождения не дольше timeout секунд.
+    """
+
+    def __init__(self, alias, size, timeout, max_age, health_checks):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.health_checks = health_checks
+        self._condition = threading.Condition()
+        self._idle = []
+        self._created = {}
+        self._total = 0
+        self.closed = False
+
+    def checkout(self, connect):
+        """Выдает соединение из пула; connect открывает новое."""
+
+        deadline = time.monotonic() + self.timeout
+        while True:
+            started = time.perf_counter()
+            try:
+                connection = self._acquire(deadline)
+            finally:
+                connection_stats.add(
+                    self.alias,
+                    checkout_wait_seconds=time.perf_counter() - started
+                )
+            if connection is None:
+                try:
+                    connection = connect()
+                except BaseException:
+                    self._release_slot()
+                    raise
+                with self._condition:
+                    self._created[connection] = time.monotonic()
+                break
+            if self._is_usable(connection):
+                break
+            self.discard(connection)
+        connection_stats.add(self.alias, checkouts=1)
+        return connection
+
+    def checkin(self, connection):
+        """Возвращает соединение; незавершенная транзакция откатывается."""
+
+        try:
+            if not connection.closed and (
+                connection.get_transaction_status() != TRANSACTION_STATUS_IDLE
+            ):
+                connection.rollback()
+            reusable = not connection.closed
+        except Error:
+            reusable = False
+        if not reusable or self.closed:
+            self.discard(connection)
+            return
+        with self._condition:
+            self._idle.append(connection)
+            self._condition.notify()
+
+    def discard(self, connection):
+        """Закрывает соединение и освобождает его место в пуле."""
+
+        with self._condition:
+            self._created.pop(connection, None)
+            self._total -= 1
+            self._condition.notify()
+        try:
+            connection.close()
+        except Error:
+            pass
+
+    def close(self):
+        """Закрывает свободные соединения, занятые закроются
+        при возврате."""
+
+        with self._condition:
+            self.closed = True
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            self.discard(connection)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._condition:
+            return {
+                'pool_size': self.size,
+                'idle': len(self._idle),
+                'in_use': self._total - len(self._idle),
+                'max_age_seconds': max(
+                    (now - created for created in self._created.values()),
+                    default=0
+                ),
+            }
+
+    def _acquire(self, deadline):
+        """Свободное соединение или None, если можно открыть новое."""
+
+        with self._condition:
+            while not self._idle and self._total >= self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    connection_stats.add(self.alias, timeouts=1)
+                    raise OperationalError(
+                        f'Пул соединений {self.alias} исчерпан: нет '
+                        f'свободного соединения за {self.timeout} с '
+                        f'(размер пула {self.size}).'
+                    )
+                self._condition.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._total += 1
+            return None
+
+    def _release_slot(self):
+        with self._condition:
+            self._total -= 1
+            self._condition.notify()
+
+    def _is_usable(self, connection):
+        if connection.closed:
+            return False
+        created = self._created.get(connection, 0)
+        if self.max_age is not None and (
+            time.monotonic() - created >= self.max_age
+        ):
+            return False
+        if not self.health_checks:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        except Error:
+            connection_stats.add(self.alias, health_check_failures=1)
+            return False
+        return True
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict, conn_params):
+    """Пул для псевдонима и параметров подключения.
+
+    Параметры входят в ключ, чтобы тестовая база получила свой пул.
+    """
+
+    key = (alias, repr(sorted(conn_params.items())))
+    pool = pools.get(key)
+    if pool is None:
+        with pools_lock:
+            pool = pools.get(key)
+            if pool is None:
+                pool = pools[key] = ConnectionPool(
+                    alias,
+                    settings_dict['POOL_SIZE'],
+                    settings_dict.get('POOL_TIMEOUT', 10),
+                    settings_dict['CONN_MAX_AGE'],
+                    settings_dict.get('CONN_HEALTH_CHECKS', False)
+                )
+    return pool
+
+
+def close_pools(alias=None):
+    """Закрывает пулы; следующее подключение создаст новый пул."""
+
+    with pools_lock:
+        selected = [
+            pools.pop(key) for key in list(pools)
+            if alias is None or key[0] == alias
+        ]
+    for pool in selected:
+        pool.close()
+
+
+def collect():
+    """Счетчики и состояние пулов по псевдонимам баз."""
+
+    values = connection_stats.snapshot()
+    with pools_lock:
+        selected = list(pools.values())
+    for pool in selected:
+        row = values.setdefault(
+            pool.alias, dict.fromkeys(ConnectionStats.counters, 0)
+        )
+        for name, value in pool.stats().items():
+            if name == 'max_age_seconds':
+                row[name] = max(row.get(name, 0), value)
+            else:
+                row[name] = row.get(name, 0) + value
+    return values
@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'recipes.apps.RecipesConfig',
     'users.apps.UsersConfig',
     'api.apps.ApiConfig',
@@ -36,6 +37,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
+    'api.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,21 +68,115 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
+# При запуске через ASGI (foodgram/asgi.py) горячие представления на чтение
+# выполняются асинхронно в пуле из ASYNC_VIEW_THREADS потоков.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
+ASYNC_VIEW_THREADS = int(os.getenv('ASYNC_VIEW_THREADS', 8))
+
 
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Соединения с базой: CONN_MAX_AGE — сколько секунд соединение
+# переживает HTTP-запросы (0 — закрывается после каждого), при
+# CONN_HEALTH_CHECKS оно проверяется перед повторным использованием.
+# DB_POOL_SIZE > 0 включает пул соединений процесса для потоковых
+# и асинхронных воркеров (см. foodgram/postgresql/base.py).
+# Под ASGI (SERVER_MODE=asgi, задается в foodgram/asgi.py) синхронный
+# код каждого запроса выполняется в новом потоке, и постоянные
+# соединения таких потоков не переиспользуются, а копятся до закрытия
+# по таймауту. Поэтому без пула там по умолчанию CONN_MAX_AGE=0.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0))
+DEFAULT_CONN_MAX_AGE = 0 if SERVER_MODE == 'asgi' and not DB_POOL_SIZE else 60
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', ''),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', DEFAULT_CONN_MAX_AGE)),
+        'CONN_HEALTH_CHECKS': os.getenv('CONN_HEALTH_CHECKS', 'True') == 'True',
+        'POOL_SIZE': DB_POOL_SIZE,
+        'POOL_TIMEOUT': int(os.getenv('DB_POOL_TIMEOUT', 10)),
     }
 }
+
+# Реплики для чтения: "хост[:порт][/база]" через запятую. Для локальной
+# проверки подойдет вторая база на том же сервере: localhost/foodgram_replica.
+# В тестах реплики зеркалируют основную базу.
+for number, replica in enumerate(filter(None, map(
+    str.strip, os.getenv('POSTGRES_REPLICAS', '').split(',')
+)), start=1):
+    address, _, name = replica.partition('/')
+    host, _, port = address.partition(':')
+    DATABASES[f'replica_{number}'] = {
+        **DATABASES['default'],
+        'NAME': name or DATABASES['default']['NAME'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['api.replicas.ReplicaRouter']
+# Сколько секунд после изменения клиент читает из основной базы.
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 5))
 AUTH_USER_MODEL = 'users.User'
+
+# Cache
+# Локальный кэш подходит для разработки; для нескольких воркеров задайте
+# файловый (django.core.cache.backends.filebased.FileBasedCache) или
+# Redis-совместимый бэкенд через CACHE_BACKEND и CACHE_LOCATION.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+# Версия индекса ингредиентов и поколения кэша ответов хранятся в кэше
+# и должны быть видны всем процессам, включая data_loader
+# и process_images. У локального кэша каждый процесс свой, поэтому
+# с ним индекс не используется, а ответы и слаги тегов не кэшируются.
+SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+SHOPPING_CART_CACHE_TIMEOUT = int(
+    os.getenv('SHOPPING_CART_CACHE_TIMEOUT', 60 * 60 * 24)
+)
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = int(
+    os.getenv('INGREDIENT_AUTOCOMPLETE_LIMIT', 50)
+)
+# Сколько секунд процесс ищет ингредиенты по своему индексу в памяти,
+# не проверяя изменения из других процессов; 0 — искать в базе.
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 60))
+# То же для соответствия слагов тегов их id в фильтре рецептов;
+# 0 — читать теги из базы на каждый запрос.
+TAG_SLUGS_TTL = int(os.getenv('TAG_SLUGS_TTL', 60))
+
+# Кэш ответов для анонимных пользователей: время хранения данных
+# в кэше и max-age для браузеров и прокси.
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60 * 10))
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', 60))
+
+# Авторы с большим числом подписчиков попадают в ленту при чтении,
+# а не копируются в ленту каждого подписчика при публикации.
+FEED_FANOUT_LIMIT = int(os.getenv('FEED_FANOUT_LIMIT', 1000))
+
+# Короткие ссылки: размер LRU в процессе, число кодов последних
+# рецептов, загружаемых в LRU при первом переходе по ссылке (0 отключает
+# загрузку), и время кэширования постоянного редиректа клиентами.
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 10000))
+SHORT_LINK_PREWARM = int(os.getenv('SHORT_LINK_PREWARM', 200))
+SHORT_LINK_MAX_AGE = int(os.getenv('SHORT_LINK_MAX_AGE', 60 * 60 * 24))
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -122,6 +219,48 @@ STATIC_ROOT = BASE_DIR / 'static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Миниатюры изображений создаются фоновым воркером process_images,
+# он же перекодирует загруженный оригинал в IMAGE_THUMBNAIL_FORMAT
+# и уменьшает его до IMAGE_ORIGINAL_MAX_SIZE. Размер задается
+# по большей стороне в пикселях.
+IMAGE_THUMBNAIL_SIZES = {
+    'recipes.recipe.image': {'card': 480, 'detail': 1200},
+    'users.user.avatar': {'small': 96, 'large': 320},
+}
+IMAGE_THUMBNAIL_FORMAT = os.getenv('IMAGE_THUMBNAIL_FORMAT', 'WEBP')
+IMAGE_THUMBNAIL_QUALITY = int(os.getenv('IMAGE_THUMBNAIL_QUALITY', 80))
+IMAGE_ORIGINAL_MAX_SIZE = int(os.getenv('IMAGE_ORIGINAL_MAX_SIZE', 2400))
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+# Задание, которое обрабатывается дольше этого числа секунд (например,
+# воркер упал), снова забирается из очереди.
+IMAGE_JOB_TIMEOUT = int(os.getenv('IMAGE_JOB_TIMEOUT', 300))
+
+# Бюджеты SQL-запросов на представление ('<Вьюсет>.<действие>')
+# в PostgreSQL, включая запрос токена при аутентификации и
+# перестроение соответствия слагов тегов раз в TAG_SLUGS_TTL.
+# Превышение пишется в лог и в метрики. Строгий режим включается
+# только в тестах (foodgram.test_settings): запрос сверх бюджета
+# не выполняется, а завершается ошибкой.
+QUERY_BUDGETS = {
+    'TagViewSet.list': 2,
+    'TagViewSet.retrieve': 2,
+    'IngredientViewSet.list': 2,
+    'IngredientViewSet.retrieve': 2,
+    'RecipeViewSet.list': 7,
+    'RecipeViewSet.retrieve': 5,
+    'RecipeViewSet.feed': 7,
+    'RecipeViewSet.favorite': 3,
+    'RecipeViewSet.shopping_cart': 3,
+    'RecipeViewSet.download_shopping_cart': 3,
+    'UserViewSet.subscriptions': 5,
+    'UserViewSet.subscribe': 7,
+}
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True') == 'True'
+# /metrics требует заголовок Authorization: Bearer <токен>. Без токена
+# метрики отдаются только при DEBUG=True.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -133,12 +272,40 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 
     'PAGE_SIZE': 6,
 }
 
+# Списки рецептов строятся из строк values() без экземпляров моделей
+# и вложенных сериализаторов (RecipeRowSerializer).
+FAST_RECIPE_LIST = os.getenv('FAST_RECIPE_LIST', 'True') == 'True'
+
+# Кэш аутентификации по токену: время жизни снимка пользователя
+# в общем кэше и в памяти процесса, размер кэша процесса. Снимок
+# в памяти не перепроверяется, поэтому AUTH_TOKEN_LOCAL_TIMEOUT
+# ограничивает, сколько другие процессы принимают отозванный токен.
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', 60))
+AUTH_TOKEN_LOCAL_TIMEOUT = int(os.getenv('AUTH_TOKEN_LOCAL_TIMEOUT', 5))
+AUTH_TOKEN_LOCAL_CACHE_SIZE = int(
+    os.getenv('AUTH_TOKEN_LOCAL_CACHE_SIZE', 10000)
+)
+# Подписанные токены проверяются без запроса к базе по поколению
+# User.token_generation, которое увеличивается при выходе, смене пароля,
+# прав и деактивации и кэшируется. Без общего кэша (SHARED_CACHE)
+# другие процессы не увидят отзыв, поэтому подписанные токены
+# не выдаются и не принимаются.
+AUTH_SIGNED_TOKENS = os.getenv('AUTH_SIGNED_TOKENS', 'False') == 'True'
+AUTH_SIGNED_TOKEN_MAX_AGE = int(
+    os.getenv('AUTH_SIGNED_TOKEN_MAX_AGE', 60 * 60 * 24)
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
@@ -147,6 +314,7 @@ DJOSER = {
     'SERIALIZERS': {
         'user': 'api.serializers.UserProfileSerializer',
         'current_user': 'api.serializers.UserProfileSerializer',
+        'token': 'api.serializers.AuthTokenSerializer',
     },
     'PERMISSIONS': {
         'user': ['djoser.permissions.CurrentUserOrAdminOrReadOnly'],
@@ -0,0 +1,17 @@
+"""Настройки для тестов.
+
+python manage.py test --settings=foodgram.test_settings
+"""
+
+from .settings import *  # noqa: F401, F403
+
+QUERY_BUDGET_STRICT = True
+
+# Зеркало основной базы для проверки маршрутизации чтения. Ему, как
+# отставшей реплике, не видны незафиксированные данные TestCase.
+# Чтение из него включается через override_settings(REPLICA_DATABASES=...).
+DATABASES['replica_1'] = {  # noqa: F405
+    **DATABASES['default'],  # noqa: F405
+    'TEST': {'MIRROR': 'default'},
+}
+REPLICA_DATABASES = []
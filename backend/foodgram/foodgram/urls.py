@@ -1,15 +1,19 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
-from api.views import redirect_short_link
+from api.async_views import async_view
+from api.views import metrics, redirect_short_link
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
+    path('metrics', metrics, name='metrics'),
     path(
         's/<str:short_code>/',
-        redirect_short_link,
+        async_view(redirect_short_link)
+        if settings.ASYNC_VIEWS else redirect_short_link,
         name='redirect_short_link',
     ),
 ]
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
-from recipes.models import (Favorite, Ingredient, Recipe, IngredientInRecipe,
-                            ShoppingCart, Tag)
+from recipes.models import (Favorite, ImageJob, Ingredient, Recipe,
+                            IngredientInRecipe, ShoppingCart, Tag,
+                            TagInRecipe)
 
 
 @admin.register(Tag)
@@ -25,6 +26,12 @@ class IngredientInRecipe(admin.TabularInline):
     min_num = 1
 
 
+class TagInRecipe(admin.TabularInline):
+    model = TagInRecipe
+    extra = 1
+    min_num = 1
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     list_display = (
@@ -36,12 +43,14 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     search_fields = ('name', 'author__username', 'tags__name')
     list_filter = ('tags',)
-    inlines = [IngredientInRecipe]
+    list_select_related = ('author',)
+    inlines = [IngredientInRecipe, TagInRecipe]
 
-    @admin.display(description='Добавлений в избранное')
+    @admin.display(description='Добавлений в избранное',
+                   ordering='favorites_count')
     def favorite_count(self, obj):
         """Возвращает количество добавлений рецепта в избранное."""
-        return obj.favorite.count()
+        return obj.favorites_count
 
 
 @admin.register(Favorite)
@@ -54,3 +63,13 @@ class FavoriteAdmin(admin.ModelAdmin):
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'model', 'object_id', 'field', 'status', 'created',
+        'locked_at',
+    )
+    list_filter = ('status', 'model')
+    readonly_fields = ('error',)
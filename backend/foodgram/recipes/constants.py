@@ -1,3 +1,4 @@
 MAX_LENGTH = 200
 MAX_LENGTH_TAG = 32
 UUID_MAX_LENGTH = 22
+SEARCH_CONFIG = 'russian'
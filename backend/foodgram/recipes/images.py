@@ -0,0 +1,168 @@
+import io
+import os
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageJob
+
+THUMBNAILS_DIR = 'thumbnails'
+
+
+def thumbnail_sizes(model, field):
+    """Размеры миниатюр для поля изображения модели."""
+
+    return settings.IMAGE_THUMBNAIL_SIZES[
+        f'{model._meta.label_lower}.{field}'
+    ]
+
+
+def discard_thumbnails(instance, field):
+    """Удаляет файлы миниатюр и очищает их список без сохранения."""
+
+    thumbnails_field = f'{field}_thumbnails'
+    storage = getattr(instance, field).storage
+    for path in getattr(instance, thumbnails_field).values():
+        storage.delete(path)
+    setattr(instance, thumbnails_field, {})
+
+
+def enqueue_image(instance, field):
+    """Ставит изображение в очередь на создание миниатюр."""
+
+    image = getattr(instance, field)
+    if not image:
+        return None
+    return ImageJob.objects.create(
+        model=instance._meta.label_lower,
+        object_id=instance.pk,
+        field=field,
+        image=image.name,
+    )
+
+
+def claim_jobs(limit):
+    """Забирает ожидающие задания, пропуская занятые другими воркерами.
+
+    Задания, взятые в обработку больше IMAGE_JOB_TIMEOUT секунд назад,
+    считаются брошенными упавшим воркером и забираются повторно.
+    """
+
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.IMAGE_JOB_TIMEOUT)
+    with transaction.atomic():
+        jobs = list(
+            ImageJob.objects.select_for_update(skip_locked=True).filter(
+                Q(status=ImageJob.PENDING)
+                | Q(status=ImageJob.PROCESSING, locked_at__lt=expired)
+            )[:limit]
+        )
+        ImageJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=ImageJob.PROCESSING, locked_at=now
+        )
+    return jobs
+
+
+def render_image(original, size):
+    """Уменьшает изображение до size по большей стороне
+    и перекодирует его в формате IMAGE_THUMBNAIL_FORMAT."""
+
+    image_format = settings.IMAGE_THUMBNAIL_FORMAT
+    image = original.copy()
+    image.thumbnail((size, size))
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format,
+               quality=settings.IMAGE_THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def reencode_original(image, original, extension):
+    """Сохраняет оригинал в формате миниатюр, уменьшенный до
+    IMAGE_ORIGINAL_MAX_SIZE, и возвращает имя нового файла.
+
+    Оригинал, который уже в нужном формате и не больше предела,
+    остается как есть.
+    """
+
+    max_size = settings.IMAGE_ORIGINAL_MAX_SIZE
+    if (original.format == settings.IMAGE_THUMBNAIL_FORMAT
+            and max(original.size) <= max_size):
+        return image.name
+    directory = os.path.dirname(image.name)
+    stem = os.path.splitext(os.path.basename(image.name))[0]
+    return image.storage.save(
+        f'{directory}/{stem}.{extension}',
+        ContentFile(render_image(original, max_size))
+    )
+
+
+def process_job(job):
+    """Перекодирует изображение задания, создает миниатюры и сохраняет
+    их пути в объекте; исходный файл загрузки удаляется.
+
+    Если изображение успело смениться, задание завершается без записи:
+    новое изображение обработает собственное задание.
+    """
+
+    close_old_connections()
+    model = apps.get_model(job.model)
+    try:
+        image = getattr(
+            model.objects.only('pk', job.field).get(pk=job.object_id),
+            job.field
+        )
+        if image.name != job.image:
+            job.status = ImageJob.DONE
+            job.save(update_fields=('status',))
+            return
+        with image.open('rb') as file:
+            original = Image.open(file)
+            original.load()
+        image_format = original.format
+        # Метаданные при перекодировании теряются, поэтому поворот
+        # из EXIF применяется к пикселям.
+        original = ImageOps.exif_transpose(original)
+        original.format = image_format
+        stem = os.path.splitext(os.path.basename(image.name))[0]
+        extension = settings.IMAGE_THUMBNAIL_FORMAT.lower()
+        name = reencode_original(image, original, extension)
+        thumbnails = {}
+        for size_name, size in thumbnail_sizes(model, job.field).items():
+            thumbnails[size_name] = image.storage.save(
+                f'{THUMBNAILS_DIR}/{stem}_{size_name}.{extension}',
+                ContentFile(render_image(original, size))
+            )
+        created = list(thumbnails.values())
+        if name != job.image:
+            created.append(name)
+        updated = model.objects.filter(
+            pk=job.object_id, **{job.field: job.image}
+        ).update(**{
+            job.field: name, f'{job.field}_thumbnails': thumbnails
+        })
+        # Если изображение сменилось во время обработки, удаляются
+        # созданные файлы, иначе — замененная загрузка.
+        if not updated:
+            obsolete = created
+        elif name != job.image:
+            obsolete = [job.image]
+        else:
+            obsolete = []
+        for path in obsolete:
+            image.storage.delete(path)
+    except model.DoesNotExist:
+        job.status = ImageJob.DONE
+    except Exception as e:
+        job.status = ImageJob.FAILED
+        job.error = repr(e)
+    else:
+        job.status = ImageJob.DONE
+    job.save(update_fields=('status', 'error'))
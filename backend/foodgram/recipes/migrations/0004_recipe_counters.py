@@ -0,0 +1,57 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:11
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total')
+        ),
+        0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    """Заполняет счетчики существующих данных, как команда recount."""
+
+    using = schema_editor.connection.alias
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Recipe.objects.using(using).update(
+        favorites_count=count_subquery(
+            apps.get_model('recipes', 'Favorite'), 'recipe'
+        ),
+        carts_count=count_subquery(
+            apps.get_model('recipes', 'ShoppingCart'), 'recipe'
+        ),
+    )
+    apps.get_model(settings.AUTH_USER_MODEL).objects.using(using).update(
+        recipes_count=count_subquery(Recipe, 'author')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_recipe_pub_date'),
+        ('users', '0003_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в список покупок'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def copy_links(source, target, using):
+    """Переносит пары (рецепт, тег) из source в target, дубли пропускаются."""
+
+    target.objects.using(using).bulk_create(
+        (
+            target(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id, tag_id in source.objects.using(using).values_list(
+                'recipe_id', 'tag_id'
+            ).iterator(chunk_size=BATCH_SIZE)
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def tags_to_tag_in_recipe(apps, schema_editor):
+    """Связи из автоматической таблицы recipes_recipe_tags переносятся
+    в recipes_taginrecipe, где уже лежат теги из админки."""
+
+    copy_links(
+        apps.get_model('recipes', 'Recipe').tags.through,
+        apps.get_model('recipes', 'TagInRecipe'),
+        schema_editor.connection.alias
+    )
+
+
+def tag_in_recipe_to_tags(apps, schema_editor):
+    copy_links(
+        apps.get_model('recipes', 'TagInRecipe'),
+        apps.get_model('recipes', 'Recipe').tags.through,
+        schema_editor.connection.alias
+    )
+
+
+class Migration(migrations.Migration):
+    """Recipe.tags переходит на промежуточную модель TagInRecipe.
+
+    Django не меняет through у существующего поля, поэтому связи
+    копируются в recipes_taginrecipe, старое поле вместе со своей
+    таблицей удаляется и добавляется заново с through.
+    """
+
+    dependencies = [
+        ('recipes', '0007_imagejob'),
+    ]
+
+    operations = [
+        migrations.RunPython(tags_to_tag_in_recipe, tag_in_recipe_to_tags),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='tags',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='tags',
+            field=models.ManyToManyField(related_name='recipes', through='recipes.TagInRecipe', to='recipes.Tag', verbose_name='Теги'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def fill_timeline(apps, schema_editor):
+    """Заполняет ленты подписчиков рецептами, опубликованными до
+    появления лент, для авторов, рецепты которых рассылаются."""
+
+    using = schema_editor.connection.alias
+    Follow = apps.get_model('recipes', 'Follow')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    TimelineEntry = apps.get_model('recipes', 'TimelineEntry')
+    authors = Follow.objects.using(using).filter(
+        author__followers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).values_list('author_id', flat=True).distinct()
+    for author_id in authors.iterator():
+        followers = list(Follow.objects.using(using).filter(
+            author=author_id
+        ).values_list('user_id', flat=True))
+        for recipe_id, pub_date in Recipe.objects.using(using).filter(
+            author=author_id
+        ).values_list('pk', 'pub_date').iterator():
+            TimelineEntry.objects.using(using).bulk_create(
+                (
+                    TimelineEntry(
+                        user_id=user_id, recipe_id=recipe_id,
+                        pub_date=pub_date
+                    )
+                    for user_id in followers
+                ),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_tag_indexes'),
+        ('users', '0004_user_followers_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_timeline, migrations.RunPython.noop),
+    ]
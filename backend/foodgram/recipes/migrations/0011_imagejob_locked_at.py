@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_fill_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Взято в обработку'),
+        ),
+    ]
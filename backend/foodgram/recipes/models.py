@@ -1,7 +1,10 @@
 import shortuuid
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
 from django.db import models
+from django.utils import timezone
 
 from .constants import MAX_LENGTH, MAX_LENGTH_TAG, UUID_MAX_LENGTH
 
@@ -98,6 +101,7 @@ class Recipe(models.Model):
     )
     tags = models.ManyToManyField(
         Tag,
+        through='TagInRecipe',
         related_name='recipes',
         verbose_name='Теги'
     )
@@ -114,10 +118,56 @@ class Recipe(models.Model):
         default=generate_short_uuid,
         verbose_name='Короткий код',
     )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
+    pub_date = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name='Дата публикации',
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в избранное',
+    )
+    carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Добавлений в список покупок',
+    )
+    image_thumbnails = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Миниатюры фотографии',
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+            GinIndex(
+                fields=['search_vector'],
+                name='recipe_search_vector_idx'
+            ),
+            GinIndex(
+                fields=['name'],
+                name='recipe_name_trgm_idx',
+                opclasses=['gin_trgm_ops']
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -210,6 +260,7 @@ class TagInRecipe(models.Model):
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
+        db_index=False,
         verbose_name='Рецепт',
         help_text='Выберите рецепт')
 
@@ -218,10 +269,18 @@ class TagInRecipe(models.Model):
 
         verbose_name = 'Тег рецепта'
         verbose_name_plural = 'Теги рецепта'
+        # Уникальность (tag, recipe) дает индекс для фильтра по тегам,
+        # индекс (recipe, tag) - для тегов рецепта и проверки EXISTS.
         constraints = [
             models.UniqueConstraint(fields=['tag', 'recipe'],
                                     name='unique_tagrecipe')
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'tag'],
+                name='taginrecipe_recipe_tag_idx'
+            ),
+        ]
 
     def __str__(self):
         """Метод строкового представления модели."""
@@ -235,6 +294,7 @@ class UserRecipeBaseModel(models.Model):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_index=False,
         related_name='%(class)s',
         verbose_name='Пользователь',
     )
@@ -247,6 +307,8 @@ class UserRecipeBaseModel(models.Model):
 
     class Meta:
         abstract = True
+        # Индекс уникальности (user, recipe) обслуживает фильтры
+        # is_favorited/is_in_shopping_cart и заменяет индекс по user.
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'recipe'],
@@ -272,3 +334,111 @@ class Favorite(UserRecipeBaseModel):
     class Meta(UserRecipeBaseModel.Meta):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
+
+
+class TimelineEntry(models.Model):
+    """Запись ленты подписок пользователя.
+
+    Заполняется при публикации рецепта для каждого подписчика автора,
+    чтобы чтение ленты было одним проходом по индексу.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+        ordering = ('-pub_date', '-recipe')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.recipe}'
+
+
+class ImageJob(models.Model):
+    """Задание фоновой обработки загруженного изображения."""
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, 'Ожидает'),
+        (PROCESSING, 'Обрабатывается'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    model = models.CharField(
+        max_length=MAX_LENGTH,
+        verbose_name='Модель',
+    )
+    object_id = models.PositiveBigIntegerField(
+        verbose_name='Идентификатор объекта',
+    )
+    field = models.CharField(
+        max_length=MAX_LENGTH,
+        verbose_name='Поле изображения',
+    )
+    image = models.CharField(
+        max_length=MAX_LENGTH,
+        verbose_name='Файл изображения',
+    )
+    status = models.CharField(
+        max_length=max(len(status) for status, _ in STATUS_CHOICES),
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name='Статус',
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка',
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания',
+    )
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Взято в обработку',
+    )
+
+    class Meta:
+        verbose_name = 'Обработка изображения'
+        verbose_name_plural = 'Обработка изображений'
+        ordering = ('id',)
+        indexes = [
+            models.Index(
+                fields=['status', 'id'],
+                name='imagejob_status_id_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} {self.field}'
@@ -0,0 +1,272 @@
+from django.contrib.postgres.search import SearchVector
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_init, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .constants import SEARCH_CONFIG
+from .images import discard_thumbnails, enqueue_image
+from .models import Favorite, Follow, Recipe, ShoppingCart, TimelineEntry
+
+User = get_user_model()
+
+TIMELINE_BATCH_SIZE = 1000
+
+IMAGE_FIELDS = {
+    Recipe: 'image',
+    User: 'avatar',
+}
+
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'carts_count',
+}
+
+
+def recipe_search_vector():
+    """Поисковый вектор рецепта: название важнее описания."""
+
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+    )
+
+
+def update_search_vectors(queryset):
+    """Пересчитывает поисковые векторы рецептов одним UPDATE.
+
+    bulk_create не отправляет post_save, поэтому массовая запись
+    рецептов вызывает эту функцию сама после вставки.
+    """
+
+    if connections[queryset.db].vendor == 'postgresql':
+        queryset.update(search_vector=recipe_search_vector())
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(sender, instance, using, update_fields=None,
+                         **kwargs):
+    """Пересчитывает поисковый вектор после сохранения рецепта."""
+
+    if update_fields is not None and not {'name', 'text'} & set(
+        update_fields
+    ):
+        return
+    update_search_vectors(Recipe.objects.using(using).filter(pk=instance.pk))
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счетчик на delta одним UPDATE.
+
+    Счетчик не уходит ниже нуля, если он уже разошелся с данными.
+    """
+
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    """Увеличивает счетчик избранного или корзины рецепта."""
+
+    if created:
+        change_counter(Recipe, instance.recipe_id,
+                       RECIPE_COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    """Уменьшает счетчик избранного или корзины рецепта."""
+
+    change_counter(Recipe, instance.recipe_id, RECIPE_COUNTERS[sender], -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    """Увеличивает счетчик рецептов автора."""
+
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    """Уменьшает счетчик рецептов автора."""
+
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+def increment_followers_count(sender, instance, created, **kwargs):
+    """Увеличивает счетчик подписчиков автора."""
+
+    if created:
+        change_counter(User, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_followers_count(sender, instance, **kwargs):
+    """Уменьшает счетчик подписчиков автора.
+
+    Если подписчиков стало ровно FEED_FANOUT_LIMIT, рецепты автора
+    снова рассылаются по лентам, и после фиксации в ленты добавляются
+    рецепты, опубликованные, пока подписчиков было больше.
+    """
+
+    author_id = instance.author_id
+    change_counter(User, author_id, 'followers_count', -1)
+    if User.objects.filter(
+        pk=author_id, followers_count=settings.FEED_FANOUT_LIMIT
+    ).exists():
+        transaction.on_commit(lambda: fill_author_timelines(author_id))
+
+
+def is_fanout_author(author_id):
+    """Рассылаются ли рецепты автора по лентам при публикации.
+
+    Рецепты авторов с большим числом подписчиков не копируются
+    в ленты, а добавляются при чтении.
+    """
+
+    return User.objects.filter(
+        pk=author_id,
+        followers_count__lte=settings.FEED_FANOUT_LIMIT
+    ).exists()
+
+
+def fill_author_timelines(author_id):
+    """Добавляет все рецепты автора в ленты всех его подписчиков."""
+
+    followers = list(Follow.objects.filter(
+        author=author_id
+    ).values_list('user_id', flat=True))
+    for recipe_id, pub_date in Recipe.objects.filter(
+        author=author_id
+    ).values_list('pk', 'pub_date').iterator():
+        TimelineEntry.objects.bulk_create(
+            (
+                TimelineEntry(
+                    user_id=user_id, recipe_id=recipe_id, pub_date=pub_date
+                )
+                for user_id in followers
+            ),
+            batch_size=TIMELINE_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+
+    if not created or not is_fanout_author(instance.author_id):
+        return
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=user_id, recipe=instance, pub_date=instance.pub_date
+            )
+            for user_id in Follow.objects.filter(
+                author=instance.author_id
+            ).values_list('user_id', flat=True).iterator()
+        ),
+        ignore_conflicts=True
+    )
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, **kwargs):
+    """Добавляет рецепты автора в ленту нового подписчика."""
+
+    if not created or not is_fanout_author(instance.author_id):
+        return
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(
+                user_id=instance.user_id, recipe_id=recipe_id,
+                pub_date=pub_date
+            )
+            for recipe_id, pub_date in Recipe.objects.filter(
+                author=instance.author_id
+            ).values_list('pk', 'pub_date').iterator()
+        ),
+        ignore_conflicts=True
+    )
+
+
+@receiver(post_delete, sender=Follow)
+def clear_timeline(sender, instance, **kwargs):
+    """Убирает рецепты автора из ленты отписавшегося пользователя."""
+
+    TimelineEntry.objects.filter(
+        user=instance.user_id, recipe__author=instance.author_id
+    ).delete()
+
+
+def saved_image_name(instance, field):
+    """Имя файла изображения без обращения к базе.
+
+    Для отложенного поля возвращает None.
+    """
+
+    value = instance.__dict__.get(field)
+    return getattr(value, 'name', value) or None
+
+
+def image_changed(sender, instance, created, update_fields):
+    """Сохраняется ли новое изображение объекта."""
+
+    field = IMAGE_FIELDS[sender]
+    if update_fields is not None and field not in update_fields:
+        return False
+    return created or (
+        (getattr(instance, field).name or None)
+        != instance._saved_image_name
+    )
+
+
+@receiver(post_init, sender=Recipe)
+@receiver(post_init, sender=User)
+def remember_image(sender, instance, **kwargs):
+    """Запоминает изображение объекта, чтобы при сохранении заметить
+    его замену из API, админки или кода."""
+
+    instance._saved_image_name = saved_image_name(
+        instance, IMAGE_FIELDS[sender]
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=User)
+def discard_replaced_thumbnails(sender, instance, raw, update_fields=None,
+                                **kwargs):
+    """Удаляет миниатюры замененного изображения."""
+
+    if not raw and image_changed(
+        sender, instance, instance._state.adding, update_fields
+    ):
+        discard_thumbnails(instance, IMAGE_FIELDS[sender])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def enqueue_changed_image(sender, instance, created, raw,
+                          update_fields=None, **kwargs):
+    """Ставит новое изображение в очередь на создание миниатюр.
+
+    Задание создается в той же транзакции, поэтому воркер не увидит
+    его, если сохранение откатится.
+    """
+
+    if raw or not image_changed(sender, instance, created, update_fields):
+        return
+    field = IMAGE_FIELDS[sender]
+    enqueue_image(instance, field)
+    instance._saved_image_name = saved_image_name(instance, field)
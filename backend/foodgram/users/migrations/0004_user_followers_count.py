@@ -0,0 +1,42 @@
+# Generated by Django 3.2.16 on 2026-10-18 06:11
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_followers_count(apps, schema_editor):
+    """Заполняет счетчик подписчиков существующих авторов."""
+
+    Follow = apps.get_model('recipes', 'Follow')
+    apps.get_model('users', 'User').objects.using(
+        schema_editor.connection.alias
+    ).update(
+        followers_count=Coalesce(
+            Subquery(
+                Follow.objects.filter(author=OuterRef('pk')).order_by().values(
+                    'author'
+                ).annotate(total=Count('pk')).values('total')
+            ),
+            0
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0001_initial'),
+        ('users', '0003_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.RunPython(
+            fill_followers_count, migrations.RunPython.noop
+        ),
+    ]
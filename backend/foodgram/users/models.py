@@ -36,6 +36,27 @@ class User(AbstractUser):
         null=True,
         verbose_name='Аватар',
     )
+    avatar_thumbnails = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Миниатюры аватара',
+    )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+    token_generation = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Поколение токенов',
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']